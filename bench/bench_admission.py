@@ -0,0 +1,48 @@
+"""백엔드 동시성 제한 비교: 제한 없음 vs ADMISSION_LIMITS
+
+    python bench/bench_admission.py --concurrency 40 --requests 300
+
+TTS 스텁을 동시 합성 STUB_TTS_CAPACITY개로 묶어(GPU 흉내) 처리량보다 많은 요청을 보낸다.
+제한이 없으면 모든 요청이 TTS 앞에서 같이 느려지고, 제한이 있으면 넘친 요청은 503으로 바로
+돌아가고 받아들인 요청의 지연은 평소 수준을 유지해야 한다.
+"""
+import argparse, os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run_suite import run_suite
+
+UNLIMITED = "tts=100000/0/1,analyze=100000/0/1,openai=100000/0/1,weather=100000/0/1,news=100000/0/1"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=40)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--capacity", type=int, default=4, help="스텁 TTS 동시 합성 수")
+    parser.add_argument("--limits", default="tts=4/2/0.5", help="제한 있음 쪽 ADMISSION_LIMITS")
+    parser.add_argument("--env", action="append", default=[], help="공통 KEY=VALUE (STUB_RUN_MS 등)")
+    args = parser.parse_args()
+    common = dict(kv.split("=", 1) for kv in args.env)
+    common["STUB_TTS_CAPACITY"] = str(args.capacity)
+
+    print(f"{'config':<10} {'req/s':>6} {'ok/s':>5} {'200':>5} {'503':>5} {'total p50':>10} {'total p95':>10} "
+          f"{'503 p50':>8} {'tts queue p95':>14}")
+    # idle: 부하가 없을 때의 기준 지연
+    for name, limits, concurrency, requests in (
+        ("idle", UNLIMITED, 2, 20),
+        ("unlimited", UNLIMITED, args.concurrency, args.requests),
+        ("limited", args.limits, args.concurrency, args.requests),
+    ):
+        summary, metrics, _ = run_suite(
+            {**common, "ADMISSION_LIMITS": limits}, concurrency, requests,
+            ["--unique"], verbose=False,
+        )
+        statuses = summary["statuses"]
+        queue = metrics["stages"].get("queue:tts", {})
+        print(f"{name:<10} {summary['throughput']:6.1f} {statuses.get(200, 0) / summary['elapsed']:5.1f} "
+              f"{statuses.get(200, 0):5d} {statuses.get(503, 0):5d} "
+              f"{summary['total']['p50']:10.1f} {summary['total']['p95']:10.1f} "
+              f"{summary.get('shed', {}).get('p50', 0.0):8.1f} {str(queue.get('p95_ms')):>14}")
+
+if __name__ == "__main__":
+    main()
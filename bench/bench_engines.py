@@ -0,0 +1,44 @@
+"""엔진 비교: Assistants(poll / stream) vs Chat Completions + 로컬 대화 기록
+
+    python bench/bench_engines.py --concurrency 10 --requests 60 --users 10
+
+같은 스텁 워크로드(도구 호출이 섞인 메시지, 사용자당 여러 턴)로 각 엔진을 측정한다.
+"""
+import argparse, os, sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from run_suite import run_suite
+
+CONFIGS = [
+    ("assistants/poll", {"ENGINE": "assistants", "RUN_MODE": "poll"}),
+    ("assistants/stream", {"ENGINE": "assistants", "RUN_MODE": "stream"}),
+    ("chat", {"ENGINE": "chat"}),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=60)
+    parser.add_argument("--users", type=int, default=10, help="사용자당 여러 턴 (분당 10회 이내로)")
+    parser.add_argument("--env", action="append", default=[], help="공통 KEY=VALUE (STUB_RUN_MS 등)")
+    args = parser.parse_args()
+    common = dict(kv.split("=", 1) for kv in args.env)
+
+    print(f"{'engine':<18} {'req/s':>6} {'ttfb p50':>9} {'ttfb p95':>9} "
+          f"{'total p50':>10} {'total p95':>10} {'openai/turn':>12}  status")
+    for name, env in CONFIGS:
+        summary, _, stub_stats = run_suite(
+            {**common, **env}, args.concurrency, args.requests,
+            ["--users", str(args.users)], verbose=False,
+        )
+        # Assistant 준비 호출은 제외하고 턴당 OpenAI 왕복 수
+        openai_calls = sum(v for k, v in stub_stats.items()
+                           if k.startswith("openai:") and not k.startswith("openai:assistants."))
+        print(f"{name:<18} {summary['throughput']:6.1f} {summary['ttfb']['p50']:9.1f} "
+              f"{summary['ttfb']['p95']:9.1f} {summary['total']['p50']:10.1f} "
+              f"{summary['total']['p95']:10.1f} {openai_calls / summary['requests']:12.2f}  "
+              f"{summary['statuses']}")
+
+if __name__ == "__main__":
+    main()
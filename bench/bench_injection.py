@@ -0,0 +1,74 @@
+"""InjectionDefense 벤치마크 (공격 코퍼스 + 일반 트래픽)
+
+    python bench/bench_injection.py
+"""
+import os, re, sys, time
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, ROOT)
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+from rene_app import InjectionDefense
+
+ROUNDS = 2000
+
+BENIGN = [
+    "こんにちは！",
+    "今何時？",
+    "今日は何曜日？",
+    "大阪の天気はどう？明日は雨かな",
+    "5かける3はいくつ？",
+    "今日の運勢を占って！ラッキーアイテムも教えてね",
+    "最近のニュースを教えて",
+    "お腹すいた〜何食べようかな",
+    "昨日友達と映画を見に行ったんだけど、すごく面白かったよ！主人公が最後に猫を助けるシーンで泣いちゃった",
+    "ねえねえ、週末どこか遊びに行きたいな。おすすめの場所ある？",
+]
+
+def load_attacks():
+    path = os.path.join(ROOT, "공격프롬프트 정리.md")
+    with open(path, encoding="utf-8") as f:
+        return re.findall(r'^\d+\. "(.+?)"', f.read(), re.MULTILINE)
+
+def legacy_is_injection(defense, user_input):
+    """비교용: 이전 구현 (키워드마다 부분 문자열 검색 + 패턴마다 re.search)"""
+    input_lower = user_input.lower()
+    for keyword in defense.danger_keywords:
+        if keyword in input_lower:
+            return True
+    for pattern in defense.danger_patterns:
+        if re.search(pattern, input_lower, re.IGNORECASE):
+            return True
+    return False
+
+def bench(name, check, messages):
+    t = time.perf_counter()
+    for _ in range(ROUNDS):
+        for message in messages:
+            check(message)
+    return (time.perf_counter() - t) / ROUNDS / len(messages) * 1e6
+
+def report(defense, label):
+    attacks = load_attacks()
+    for corpus, messages in (("attack", attacks), ("benign", BENIGN)):
+        legacy = bench("legacy", lambda m: legacy_is_injection(defense, m), messages)
+        compiled = bench("compiled", defense.is_injection_attempt, messages)
+        print(f"{label:10s} {corpus:7s} n={len(messages):3d}  "
+              f"legacy: {legacy:6.2f} us/msg  compiled: {compiled:6.2f} us/msg")
+
+if __name__ == "__main__":
+    defense = InjectionDefense()
+    attacks = load_attacks()
+
+    mismatch = [m for m in attacks + BENIGN
+                if legacy_is_injection(defense, m) != defense.is_injection_attempt(m)]
+    blocked = sum(defense.is_injection_attempt(m) for m in attacks)
+    print(f"attack corpus: {blocked}/{len(attacks)} blocked, "
+          f"benign false positives: {sum(map(defense.is_injection_attempt, BENIGN))}, "
+          f"legacy mismatches: {len(mismatch)}")
+    report(defense, "rules x1")
+
+    # 규칙을 늘려도 메시지당 비용이 크게 늘지 않는지 확인
+    defense.danger_keywords = defense.danger_keywords + [f"blocked_word_{i}" for i in range(300)]
+    defense._compile_rules()
+    report(defense, "rules x10")
@@ -0,0 +1,84 @@
+"""IntentRouter 벤치마크 + 라우팅 코퍼스
+
+    python bench/bench_intent.py
+
+- ROUTED는 기대한 인텐트로 즉답해야 한다.
+- FALLBACK은 라우터가 답하지 않고 LLM으로 넘겨야 한다 (날짜 모양 수식, 다른 말이 섞인 질문 등).
+"""
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+from rene_app import IntentRouter
+
+ROUNDS = 2000
+
+ROUTED = [
+    ("今何時？", "time"),
+    ("ねえレネちゃん、いま何時？", "time"),
+    ("今日は何曜日？", "date"),
+    ("今日の日付を教えて", "date"),
+    ("何月何日？", "date"),
+    ("今日は何月何日？", "date"),
+    ("今日の運勢を占って！", "fortune"),
+    ("おみくじ", "fortune"),
+    ("12 * (3 + 4)を計算して", "calculate"),
+    ("2+3は？", "calculate"),
+    ("100÷4はいくつ？", "calculate"),
+    ("2^10", "calculate"),
+]
+
+FALLBACK = [
+    # 날짜 모양
+    "10/18は何曜日？",
+    "7/7は何の日？",
+    "2024-10-18",
+    "2024/10/18",
+    "12/25",
+    # 오늘이 아닌 날/시점
+    "明日は何月何日？",
+    "来週の今日は何日？",
+    "明日の運勢を占って",
+    "昨日は何曜日だった？",
+    "3日後は何日？",
+    "あさっての運勢は？",
+    "1時間後は何時？",
+    # 수식 외에 말이 남음
+    "3+4人で行くならいくら？",
+    "1-2日後に雨が降るかな",
+    # 일반 대화
+    "こんにちは！",
+    "大阪の天気はどう？明日は雨かな",
+    "最近のニュースを教えて",
+    "昨日友達と映画を見に行ったんだけど、すごく面白かったよ！",
+]
+
+def check(router):
+    failures = []
+    for text, intent in ROUTED:
+        routed = router.route(text)
+        if routed is None or routed[0] != intent:
+            failures.append(f"expected {intent}: {text} -> {routed}")
+    for text in FALLBACK:
+        routed = router.route(text)
+        if routed is not None:
+            failures.append(f"expected fallback: {text} -> {routed}")
+    print(f"routed: {len(ROUTED)}  fallback: {len(FALLBACK)}  failures: {len(failures)}")
+    for failure in failures:
+        print(f"  {failure}")
+    return not failures
+
+def us_per_call(router, texts):
+    t = time.perf_counter()
+    for _ in range(ROUNDS):
+        for text in texts:
+            router.route(text)
+    return (time.perf_counter() - t) / ROUNDS / len(texts) * 1e6
+
+if __name__ == "__main__":
+    router = IntentRouter(threshold=0.75)
+    ok = check(router)
+    texts = [text for text, _ in ROUTED] + FALLBACK
+    print(f"route: {us_per_call(router, texts):.2f} us/message")
+    sys.exit(0 if ok else 1)
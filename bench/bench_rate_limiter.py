@@ -0,0 +1,94 @@
+"""RateLimiter 마이크로벤치마크 (10만 사용자) + 상태 저장소별 비교
+
+    python bench/bench_rate_limiter.py
+
+SQLiteState는 여러 프로세스가 같은 사용자를 동시에 두드려도 허용 횟수가 버킷 용량을 넘지 않는지 확인한다.
+"""
+import multiprocessing, os, sys, tempfile, time, tracemalloc
+from collections import defaultdict
+from datetime import datetime, timedelta
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+from rene_app import MemoryState, RateLimiter, SQLiteState
+
+N_USERS = 100_000
+
+class LegacyRateLimiter:
+    """비교용: 이전 리스트 기반 구현"""
+    def __init__(self, max_requests=10, window_minutes=1):
+        self.requests = defaultdict(list)
+        self.max_requests = max_requests
+        self.window = timedelta(minutes=window_minutes)
+        self.lock = threading.Lock()
+
+    def is_allowed(self, user_id):
+        with self.lock:
+            now = datetime.now()
+            self.requests[user_id] = [
+                t for t in self.requests[user_id] if now - t < self.window
+            ]
+            if len(self.requests[user_id]) >= self.max_requests:
+                return False
+            self.requests[user_id].append(now)
+            return True
+
+def bench(name, limiter):
+    users = [f"user_{i}" for i in range(N_USERS)]
+
+    tracemalloc.start()
+    t = time.perf_counter()
+    for u in users:
+        limiter.is_allowed(u)
+    distinct = time.perf_counter() - t
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # 한 사용자가 한도까지 쓴 뒤 계속 두드리는 경우
+    t = time.perf_counter()
+    for _ in range(N_USERS):
+        limiter.is_allowed("hot_user")
+    hot = time.perf_counter() - t
+
+    print(f"{name:8s} distinct: {distinct / N_USERS * 1e6:6.2f} us/call  "
+          f"hot: {hot / N_USERS * 1e6:6.2f} us/call  "
+          f"state: {mem / 1024 / 1024:6.1f} MiB")
+
+def hammer(path, n):
+    limiter = RateLimiter(state=SQLiteState(path))
+    return sum(limiter.is_allowed("shared_user") for _ in range(n))
+
+def check_cross_process(path, workers=4, n=200):
+    # 워커마다 별도 연결 → 전체 허용 수가 버킷 용량(10)이어야 함
+    with multiprocessing.get_context("fork").Pool(workers) as pool:
+        allowed = sum(pool.starmap(hammer, [(path, n)] * workers))
+    print(f"cross-process: {workers} workers x {n} calls -> {allowed} allowed (limit 10)")
+    return allowed == 10
+
+if __name__ == "__main__":
+    bench("legacy", LegacyRateLimiter())
+    limiter = RateLimiter(state=MemoryState())
+    bench("memory", limiter)
+
+    # 버킷이 가득 찼다고 가정하고 유휴 정리 시간 측정
+    for buckets in limiter.buckets["default"]:
+        for bucket in buckets.values():
+            bucket.updated -= 3600
+    t = time.perf_counter()
+    evicted = limiter.evict_idle()
+    print(f"evict_idle (memory): {evicted} users in {(time.perf_counter() - t) * 1000:.1f} ms, "
+          f"{len(limiter)} left")
+
+    tmp = tempfile.mkdtemp(prefix="rene_bench_")
+    sqlite = SQLiteState(os.path.join(tmp, "state.db"))
+    bench("sqlite", RateLimiter(state=sqlite))
+    sqlite.conn.execute("UPDATE state SET expires_at = expires_at - 3600")
+    t = time.perf_counter()
+    purged = sqlite.purge_expired()
+    print(f"purge_expired (sqlite): {purged} keys in {(time.perf_counter() - t) * 1000:.1f} ms, "
+          f"{sqlite.count('rl:')} left")
+
+    ok = check_cross_process(os.path.join(tmp, "shared.db")) if hasattr(os, "fork") else True
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,167 @@
+"""safe_eval 마이크로벤치마크 + 공격 수식 코퍼스
+
+    python bench/bench_safe_eval.py
+
+- 공격 수식은 전부 ValueError로 거부되고, 각각 수 ms 안에 끝나야 한다.
+- 일반 수식은 결과가 이전 구현과 같아야 한다.
+"""
+import asyncio, ast, multiprocessing, os, sys, time
+import operator as op
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "sk-bench")
+
+from rene_app import SafeEvalPool, _compile_expr, safe_eval
+
+ROUNDS = 2000
+LEGACY_TIMEOUT = 2.0  # 초
+
+BENIGN = [
+    "1 + 2",
+    "12 * (3 + 4)",
+    "100 / 3",
+    "2 ** 10",
+    "-5 + 3 * 2",
+    "1.5 * 4 - 0.25",
+    "(1 + 2) * (3 + 4) * (5 + 6)",
+    "10 % 3",
+    "2 ** 0.5",
+    "9999999999 * 9999999999",
+    "2 ** -3",
+    "1234567 * 7654321 + 42",
+    # 한도 (10**100) 안쪽의 큰 거듭제곱
+    "10**99",
+    "2**200",
+    "16**80",
+    "2**100 * 2**100",
+]
+
+ADVERSARIAL = [
+    # 결과 크기 폭주
+    "9**9**9",
+    "9**9**9**9",
+    "2**2**2**2**2",
+    "10**10**10",
+    "(10**10)**(10**10)",
+    "2**10000000",
+    "(-2)**(2**30)",
+    "9999999999**9999999999",
+    "-(9**9**9)",
+    "(9**9)**(9**9)",
+    "2**333 * 2**333",
+    " * ".join(["9999999999"] * 40),
+    " + ".join(["2**330"] * 10),
+    # float 오버플로 / 0으로 나누기
+    "1e10**1e10",
+    "7.0**1e10",
+    "1/0",
+    "5 % 0",
+    # 구조 (길이/노드/깊이)
+    "1+" * 300 + "1",
+    "-" * 150 + "1",
+    "(" * 150 + "1" + ")" * 150,
+    "+".join(["1"] * 70),
+    # 허용되지 않는 노드/상수
+    "__import__('os').system('id')",
+    "(lambda: 1)()",
+    "[1] * 10**9",
+    "'a' * 10**9",
+    "a + 1",
+    "1 if 1 else 2",
+    "12345678901 + 1",
+    "True + True",
+    "1 << 100000",
+    "sum(range(10**9))",
+]
+
+ALLOWED_OPS = {
+    ast.Add: op.add, ast.Sub: op.sub, ast.Mult: op.mul, ast.Div: op.truediv,
+    ast.Pow: op.pow, ast.USub: op.neg, ast.Mod: op.mod,
+}
+
+def legacy_safe_eval(expr, max_value=10**10):
+    """비교용: 이전 구현 (상수 크기만 검사)"""
+    def _eval(node):
+        if isinstance(node, ast.Constant):
+            if isinstance(node.value, (int, float)):
+                if abs(node.value) > max_value:
+                    raise ValueError("too big")
+                return node.value
+            raise TypeError("numbers only")
+        elif isinstance(node, ast.BinOp):
+            return ALLOWED_OPS[type(node.op)](_eval(node.left), _eval(node.right))
+        elif isinstance(node, ast.UnaryOp):
+            return ALLOWED_OPS[type(node.op)](_eval(node.operand))
+        raise TypeError(type(node))
+    try:
+        return _eval(ast.parse(expr, mode="eval").body)
+    except:
+        raise ValueError("invalid")
+
+def us_per_call(func, expressions):
+    t = time.perf_counter()
+    for _ in range(ROUNDS):
+        for expr in expressions:
+            func(expr)
+    return (time.perf_counter() - t) / ROUNDS / len(expressions) * 1e6
+
+def check_adversarial():
+    worst = 0.0
+    failures = []
+    for expr in ADVERSARIAL:
+        t = time.perf_counter()
+        try:
+            safe_eval(expr)
+            failures.append(expr)
+        except ValueError:
+            pass
+        worst = max(worst, time.perf_counter() - t)
+    print(f"adversarial: {len(ADVERSARIAL) - len(failures)}/{len(ADVERSARIAL)} rejected, "
+          f"worst {worst * 1000:.2f} ms")
+    for expr in failures:
+        print(f"  NOT REJECTED: {expr[:60]}")
+    return not failures
+
+def legacy_worst_case(expr):
+    # 이전 구현은 별도 프로세스에서, 제한 시간 안에 끝나는지만 확인
+    with multiprocessing.get_context("fork").Pool(1) as pool:
+        result = pool.apply_async(legacy_safe_eval, (expr,))
+        t = time.perf_counter()
+        try:
+            result.get(LEGACY_TIMEOUT)
+        except multiprocessing.TimeoutError:
+            return f"> {LEGACY_TIMEOUT:.0f}s (timeout)"
+        except Exception:
+            pass
+        return f"{(time.perf_counter() - t) * 1000:.1f} ms"
+
+async def pool_latency(n=200):
+    pool = SafeEvalPool(workers=2, timeout=1.0)
+    try:
+        await pool.evaluate("1 + 1")  # 워커 기동
+        t = time.perf_counter()
+        for i in range(n):
+            await pool.evaluate(f"{i} * 3 + 1")
+        return (time.perf_counter() - t) / n * 1e6
+    finally:
+        pool.close()
+
+if __name__ == "__main__":
+    ok = check_adversarial()
+
+    mismatch = [e for e in BENIGN if legacy_safe_eval(e) != safe_eval(e)]
+    print(f"benign: {len(BENIGN)} expressions, mismatches with legacy: {len(mismatch)}")
+
+    legacy = us_per_call(legacy_safe_eval, BENIGN)
+    cached = us_per_call(safe_eval, BENIGN)
+    _compile_expr.cache_clear()
+    cold = us_per_call(lambda e: (_compile_expr.cache_clear(), safe_eval(e)), BENIGN)
+    print(f"benign: legacy {legacy:6.2f} us/expr  new (AST cache hit) {cached:6.2f} us/expr  "
+          f"new (no cache) {cold:6.2f} us/expr")
+
+    if hasattr(os, "fork"):
+        print(f"process pool: {asyncio.run(pool_latency()):.0f} us/expr (round trip)")
+        for expr in ("9**9**9", "2**10000000", "(9**9)**(9**9)"):
+            print(f"legacy {expr[:30]:30s} {legacy_worst_case(expr)}")
+
+    sys.exit(0 if ok and not mismatch else 1)
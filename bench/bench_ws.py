@@ -0,0 +1,83 @@
+"""대화 전송 방식 비교: 턴마다 POST /chat-agent vs 사용자당 WebSocket 하나
+
+    python bench/bench_ws.py --users 10 --turns 5
+
+사용자마다 여러 턴을 순서대로 보내고, 턴별로 자막(응답 텍스트)·첫 음성 바이트·완료까지의 시간을 잰다.
+HTTP는 자막이 X-GPT-Reply 헤더로 오므로 첫 음성 바이트와 같은 시점, WebSocket은 reply 이벤트 시점.
+스텁의 고정 응답은 TTS 캐시에 걸리므로, 자막과 음성의 간격은 캐시되지 않는 (도구 결과) 응답에서 드러난다.
+"""
+import argparse, asyncio, itertools, json, os, sys, time
+
+import httpx
+import websockets
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from load_test import MESSAGES, percentile
+from run_suite import servers
+
+async def http_user(url, user_id, messages, samples):
+    async with httpx.AsyncClient(timeout=120) as client:
+        for message in messages:
+            start = time.perf_counter()
+            async with client.stream("POST", f"{url}/chat-agent",
+                                     json={"user_id": user_id, "message": message}) as res:
+                subtitle = first_audio = None
+                async for chunk in res.aiter_bytes():
+                    if first_audio is None and chunk:
+                        subtitle = first_audio = time.perf_counter() - start
+            if res.status_code == 200:
+                samples.append((subtitle, first_audio, time.perf_counter() - start))
+
+async def ws_user(url, user_id, messages, samples):
+    ws_url = url.replace("http://", "ws://") + f"/ws/chat-agent?user_id={user_id}"
+    async with websockets.connect(ws_url, max_size=None) as ws:
+        for message in messages:
+            start = time.perf_counter()
+            await ws.send(json.dumps({"message": message}))
+            subtitle = first_audio = None
+            while True:
+                frame = await ws.recv()
+                if isinstance(frame, bytes):
+                    if first_audio is None:
+                        first_audio = time.perf_counter() - start
+                    continue
+                event = json.loads(frame)
+                if event["type"] == "reply" and subtitle is None:
+                    subtitle = time.perf_counter() - start
+                elif event["type"] in ("done", "error"):
+                    break
+            if event["type"] == "done":
+                samples.append((subtitle, first_audio, time.perf_counter() - start))
+
+async def run(transport, url, users, turns):
+    samples = []
+    cycle = itertools.cycle(MESSAGES)
+    plans = [[next(cycle) for _ in range(turns)] for _ in range(users)]
+    user = http_user if transport == "http" else ws_user
+    await asyncio.gather(*(
+        user(url, f"{transport}_{i}", plan, samples) for i, plan in enumerate(plans)
+    ))
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=5, help="사용자당 턴 수 (분당 10회 이내로)")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE (ENGINE, STUB_RUN_MS 등)")
+    args = parser.parse_args()
+
+    print(f"{'transport':<10} {'turns':>5} {'subtitle p50':>13} {'p95':>8} "
+          f"{'audio p50':>10} {'p95':>8} {'total p50':>10} {'p95':>8}")
+    for transport in ("http", "ws"):
+        with servers([kv.split("=", 1) for kv in args.env]) as (app_url, _):
+            samples = asyncio.run(run(transport, app_url, args.users, args.turns))
+        cols = []
+        for i in range(3):
+            values = [s[i] * 1000 for s in samples if s[i] is not None]
+            cols += [percentile(values, 50), percentile(values, 95)]
+        print(f"{transport:<10} {len(samples):>5} {cols[0]:13.1f} {cols[1]:8.1f} "
+              f"{cols[2]:10.1f} {cols[3]:8.1f} {cols[4]:10.1f} {cols[5]:8.1f}")
+
+if __name__ == "__main__":
+    main()
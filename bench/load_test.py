@@ -0,0 +1,118 @@
+"""/chat-agent 부하 테스트 드라이버
+
+    python bench/load_test.py --url http://127.0.0.1:8888 --concurrency 20 --requests 200
+
+처리량, 전체 응답 시간 / 첫 바이트(TTFB) p50·p95·p99, 상태 코드 분포를 출력한다.
+레이트 리밋(분당 10회)에 걸리지 않도록 기본적으로 요청마다 다른 user_id를 쓴다.
+"""
+import argparse, asyncio, itertools, time
+from collections import Counter
+
+import httpx
+
+MESSAGES = [
+    "こんにちは！",
+    "今日はいい天気だね",
+    "東京の天気はどう？",
+    "今何時？",
+    "今日の運勢を教えて",
+    "最新のニュースある？",
+    "12 * (3 + 4)を計算して",
+    "ちょっと疲れちゃった",
+]
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+async def one_request(client, url, user_id, message, results):
+    start = time.perf_counter()
+    ttfb = None
+    try:
+        async with client.stream("POST", f"{url}/chat-agent",
+                                 json={"user_id": user_id, "message": message}) as res:
+            async for chunk in res.aiter_bytes():
+                if ttfb is None and chunk:
+                    ttfb = time.perf_counter() - start
+            status = res.status_code
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    total = time.perf_counter() - start
+    results.append((status, ttfb if ttfb is not None else total, total))
+
+async def run(url, concurrency, requests, users, messages, timeout, unique=False):
+    results = []
+    queue = asyncio.Queue()
+    for i, message in zip(range(requests), itertools.cycle(messages)):
+        user_id = f"load_{i % users if users else i}"
+        queue.put_nowait((user_id, f"{message} #{i}" if unique else message))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def worker():
+            while not queue.empty():
+                user_id, message = queue.get_nowait()
+                await one_request(client, url, user_id, message, results)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return results, elapsed
+
+def summarize(results, elapsed):
+    ok = [(ttfb, total) for status, ttfb, total in results if status == 200]
+    summary = {
+        "requests": len(results),
+        "elapsed": elapsed,
+        "throughput": len(results) / elapsed,
+        "statuses": dict(Counter(status for status, _, _ in results)),
+    }
+    for name, values in (("ttfb", [t * 1000 for t, _ in ok]), ("total", [t * 1000 for _, t in ok])):
+        summary[name] = {f"p{p}": percentile(values, p) for p in (50, 95, 99)}
+        summary[name]["max"] = max(values, default=0.0)
+    # 과부하로 거절된 요청이 얼마나 빨리 돌아왔는지
+    shed = [total * 1000 for status, _, total in results if status == 503]
+    if shed:
+        summary["shed"] = {"p50": percentile(shed, 50), "max": max(shed)}
+    return summary
+
+def report(summary, concurrency):
+    print(f"requests={summary['requests']} concurrency={concurrency} elapsed={summary['elapsed']:.2f}s "
+          f"throughput={summary['throughput']:.1f} req/s")
+    print("status: " + ", ".join(f"{k}={v}" for k, v in sorted(summary["statuses"].items(), key=str)))
+    for name in ("ttfb", "total"):
+        q = summary[name]
+        print(f"{name:>6} ms  p50={q['p50']:8.1f}  p95={q['p95']:8.1f}  "
+              f"p99={q['p99']:8.1f}  max={q['max']:8.1f}")
+    if "shed" in summary:
+        print(f"  503 ms  p50={summary['shed']['p50']:8.1f}  max={summary['shed']['max']:8.1f}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default="http://127.0.0.1:8888")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--users", type=int, default=0,
+                        help="user_id 개수 (0이면 요청마다 새 사용자)")
+    parser.add_argument("--message", action="append",
+                        help="보낼 메시지 (여러 번 지정 가능, 기본은 도구 호출이 섞인 목록)")
+    parser.add_argument("--unique", action="store_true",
+                        help="메시지 끝에 요청 번호를 붙여 감정 분석/TTS 캐시를 피함")
+    parser.add_argument("--timeout", type=float, default=120)
+    return parser.parse_args(argv)
+
+def main(argv=None, quiet=False):
+    args = parse_args(argv)
+    results, elapsed = asyncio.run(run(
+        args.url, args.concurrency, args.requests, args.users,
+        args.message or MESSAGES, args.timeout, args.unique,
+    ))
+    summary = summarize(results, elapsed)
+    if not quiet:
+        report(summary, args.concurrency)
+    return summary
+
+if __name__ == "__main__":
+    main()
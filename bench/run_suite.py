@@ -0,0 +1,113 @@
+"""스텁 백엔드 + 앱 서버를 띄우고 부하 테스트를 실행 (외부 네트워크 불필요)
+
+    python bench/run_suite.py --concurrency 20 --requests 200
+    python bench/run_suite.py --env RUN_MODE=poll --env TTS_MODE=sentence -- --users 5
+
+--env 로 앱/스텁 환경변수(STUB_RUN_MS 등)를 덮어쓰고, -- 뒤의 인자는 load_test.py로 넘긴다.
+끝나면 앱의 /metrics 단계별 p50/p95 와 스텁 호출 횟수를 출력한다.
+"""
+import argparse, os, subprocess, sys, tempfile, time
+from contextlib import contextmanager
+
+import httpx
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+import load_test
+
+def wait_ready(url, proc, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{url} 프로세스가 종료됨 (code={proc.returncode})")
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} 준비 시간 초과")
+
+def uvicorn(target, port, env):
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env,
+    )
+
+def print_metrics(app_url, stub_url):
+    metrics = httpx.get(f"{app_url}/metrics").json()
+    print("\n--- /metrics (ms) ---")
+    for name, h in metrics["stages"].items():
+        print(f"{name:>16}  n={h['count']:<5} p50={h['p50_ms']:>8}  p95={h['p95_ms']:>8}  p99={h['p99_ms']:>8}")
+    for name, count in metrics["counters"].items():
+        print(f"{name:>16}  {count}")
+    print("\n--- stub calls ---")
+    for name, count in sorted(httpx.get(f"{stub_url}/stats").json().items()):
+        print(f"{name:>28}  {count}")
+
+@contextmanager
+def servers(env_overrides=(), app_port=8888, stub_port=9100):
+    """스텁/앱 기동 → (앱 URL, 스텁 URL), 끝나면 종료"""
+    stub_url = f"http://127.0.0.1:{stub_port}"
+    app_url = f"http://127.0.0.1:{app_port}"
+    env = dict(
+        os.environ,
+        OPENAI_API_KEY="sk-bench",
+        OPENAI_BASE_URL=f"{stub_url}/v1",
+        OPENWEATHER_API_KEY="bench",
+        TTS_API=f"{stub_url}/speak",
+        ANALYZE_API=f"{stub_url}/analyze",
+        ANALYZE_BATCH_API=f"{stub_url}/analyze_batch",
+        OPENWEATHER_API_URL=f"{stub_url}/data/2.5/weather",
+        NHK_NEWS_URL=f"{stub_url}/rss/news/cat0.xml",
+        LOG_LEVEL="WARNING",
+        # 스텁은 매번 새로 뜨므로 Assistant 준비 결과를 저장소에 남기지 않음
+        ASSISTANT_STATE_PATH=os.path.join(tempfile.mkdtemp(prefix="rene_bench_"), "assistant.json"),
+    )
+    env.pop("ASSISTANT_ID", None)
+    env.pop("THREAD_DB_PATH", None)
+    env.pop("STATE_DB_PATH", None)
+    env.update(env_overrides)
+
+    stub = uvicorn("bench.stub_backends:app", stub_port, env)
+    server = None
+    try:
+        wait_ready(f"{stub_url}/stats", stub)
+        server = uvicorn("rene_app:app", app_port, env)
+        wait_ready(f"{app_url}/health", server)
+        yield app_url, stub_url
+    finally:
+        for proc in (server, stub):
+            if proc is not None:
+                proc.terminate()
+                proc.wait(timeout=10)
+
+def run_suite(env_overrides=(), concurrency=10, requests=100, load_argv=(),
+              app_port=8888, stub_port=9100, verbose=True):
+    """스텁/앱 기동 → 부하 테스트 → (요약, /metrics, 스텁 호출 수)"""
+    with servers(env_overrides, app_port, stub_port) as (app_url, stub_url):
+        argv = ["--url", app_url, "--concurrency", str(concurrency), "--requests", str(requests)]
+        summary = load_test.main(argv + list(load_argv), quiet=not verbose)
+        if verbose:
+            print_metrics(app_url, stub_url)
+        return summary, httpx.get(f"{app_url}/metrics").json(), httpx.get(f"{stub_url}/stats").json()
+
+def main():
+    argv = sys.argv[1:]
+    load_argv = argv[argv.index("--") + 1:] if "--" in argv else []
+    argv = argv[:argv.index("--")] if "--" in argv else argv
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--app-port", type=int, default=8888)
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE")
+    args = parser.parse_args(argv)
+
+    run_suite([kv.split("=", 1) for kv in args.env], args.concurrency, args.requests,
+              load_argv, args.app_port, args.stub_port)
+
+if __name__ == "__main__":
+    main()
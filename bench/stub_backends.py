@@ -0,0 +1,405 @@
+"""로컬 대역 백엔드 (OpenAI Assistants·Chat Completions / 감정 분석 / TTS / 날씨 / NHK RSS)
+
+    uvicorn bench.stub_backends:app --port 9100
+
+지연은 환경변수(ms)로 조절한다.
+    STUB_OPENAI_MS        OpenAI API 호출 1회당 왕복 지연
+    STUB_RUN_MS           모델 1턴(Run 진행 → requires_action/completed, Chat 첫 청크)
+    STUB_ANALYZE_MS       감정 분석 (배치도 1회 지연)
+    STUB_TTS_FIRST_BYTE_MS, STUB_TTS_MS_PER_CHAR  TTS 첫 바이트 / 글자당 합성 시간
+    STUB_WEATHER_MS, STUB_RSS_MS
+STUB_TTS_CAPACITY 는 TTS 동시 합성 수 (0이면 무제한) - 넘치면 GPU처럼 안에서 줄을 서서 모두 느려진다.
+"""
+import asyncio, hashlib, io, itertools, json, os, time, wave
+
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+def _ms(name, default):
+    return float(os.getenv(name, default)) / 1000
+
+OPENAI_LATENCY = _ms("STUB_OPENAI_MS", "60")
+RUN_LATENCY = _ms("STUB_RUN_MS", "800")
+ANALYZE_LATENCY = _ms("STUB_ANALYZE_MS", "80")
+TTS_FIRST_BYTE = _ms("STUB_TTS_FIRST_BYTE_MS", "300")
+TTS_PER_CHAR = _ms("STUB_TTS_MS_PER_CHAR", "30")
+WEATHER_LATENCY = _ms("STUB_WEATHER_MS", "150")
+TTS_CAPACITY = int(os.getenv("STUB_TTS_CAPACITY", "0"))
+RSS_LATENCY = _ms("STUB_RSS_MS", "200")
+
+LABELS = ["기쁨", "슬픔", "분노", "두려움", "놀라움", "혐오", "중립", "기타"]
+
+# 메시지에 들어 있으면 해당 도구를 호출하는 키워드
+TOOL_TRIGGERS = [
+    ("天気", "get_weather", {"location": "東京"}),
+    ("何時", "get_time", {}),
+    ("何日", "get_date", {}),
+    ("運勢", "get_fortune", {}),
+    ("ニュース", "get_news", {}),
+    ("計算", "calculate", {"expression": "12 * (3 + 4)"}),
+]
+
+REPLIES = [
+    "やあ、元気にしてた？",
+    "いいね、それ楽しそう！",
+    "うんうん、分かるよ。",
+    "今日もお疲れさま！",
+    "へえ、面白いね！",
+]
+
+app = FastAPI()
+stats = {}
+_ids = itertools.count(1)
+tts_slots = asyncio.Semaphore(TTS_CAPACITY) if TTS_CAPACITY else None
+
+def _count(name, n=1):
+    stats[name] = stats.get(name, 0) + n
+
+def _new_id(prefix):
+    return f"{prefix}_{next(_ids)}"
+
+def _pick(text, options):
+    """같은 입력에는 같은 응답 (캐시 효과 재현)"""
+    return options[hashlib.md5(text.encode("utf-8")).digest()[0] % len(options)]
+
+@app.get("/stats")
+def get_stats():
+    return stats
+
+# =========================
+# 감정 분석
+# =========================
+class AnalyzeRequest(BaseModel):
+    text: str
+
+class AnalyzeBatchRequest(BaseModel):
+    texts: list[str]
+
+def fake_scores(text):
+    """텍스트 해시로 정해지는 가짜 감정 점수"""
+    digest = hashlib.md5(text.encode("utf-8")).digest()
+    raw = [b + 1 for b in digest[:len(LABELS)]]
+    total = sum(raw)
+    scores = {label: round(v / total, 3) for label, v in zip(LABELS, raw)}
+    return {"emotion": max(scores, key=scores.get), "all_scores": scores}
+
+@app.post("/analyze")
+async def analyze(req: AnalyzeRequest):
+    _count("analyze_calls")
+    _count("analyze_texts")
+    await asyncio.sleep(ANALYZE_LATENCY)
+    return fake_scores(req.text)
+
+@app.post("/analyze_batch")
+async def analyze_batch(req: AnalyzeBatchRequest):
+    # GPU 배치 추론을 흉내 - 텍스트 수와 관계없이 1회 지연
+    _count("analyze_batch_calls")
+    _count("analyze_texts", len(req.texts))
+    await asyncio.sleep(ANALYZE_LATENCY)
+    return {"results": [fake_scores(text) for text in req.texts]}
+
+# =========================
+# TTS
+# =========================
+SAMPLE_RATE = 24000
+SECONDS_PER_CHAR = 0.15
+CHUNK_BYTES = 16 * 1024
+
+def fake_wav(text):
+    frames = int(SAMPLE_RATE * SECONDS_PER_CHAR * max(len(text), 1))
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(b"\x00\x01" * frames)
+    return buf.getvalue()
+
+@app.post("/speak")
+async def speak(request: Request):
+    payload = await request.json()
+    text = payload.get("text", "")
+    _count("tts_calls")
+    audio = fake_wav(text)
+    chunks = [audio[i:i + CHUNK_BYTES] for i in range(0, len(audio), CHUNK_BYTES)]
+    # 첫 바이트 이후 남은 합성 시간을 청크에 나눠 흘려보냄
+    per_chunk = TTS_PER_CHAR * len(text) / len(chunks)
+
+    async def synthesize():
+        await asyncio.sleep(TTS_FIRST_BYTE)
+        for chunk in chunks:
+            yield chunk
+            await asyncio.sleep(per_chunk)
+
+    async def body():
+        if tts_slots is None:
+            async for chunk in synthesize():
+                yield chunk
+            return
+        async with tts_slots:
+            async for chunk in synthesize():
+                yield chunk
+
+    return StreamingResponse(body(), media_type="audio/wav")
+
+# =========================
+# 날씨 / 뉴스
+# =========================
+@app.get("/data/2.5/weather")
+async def weather(q: str = ""):
+    _count("weather_calls")
+    await asyncio.sleep(WEATHER_LATENCY)
+    return {"weather": [{"description": "晴れ"}], "main": {"temp": 21.4}, "name": q.split(",")[0]}
+
+RSS_ETAG = '"stub-rss-1"'
+RSS_BODY = (
+    '<?xml version="1.0" encoding="UTF-8"?><rss version="2.0"><channel><title>NHK</title>'
+    + "".join(
+        f"<item><title>テストニュース{i}：今日の出来事について</title>"
+        f"<link>https://example.com/news/{i}</link>"
+        f"<pubDate>Mon, 01 Jan 2024 0{i}:00:00 +0900</pubDate></item>"
+        for i in range(10)
+    )
+    + "</channel></rss>"
+).encode("utf-8")
+
+@app.get("/rss/news/cat0.xml")
+async def rss(request: Request):
+    _count("rss_calls")
+    await asyncio.sleep(RSS_LATENCY)
+    if request.headers.get("if-none-match") == RSS_ETAG:
+        return Response(status_code=304)
+    return Response(RSS_BODY, media_type="application/rss+xml", headers={"ETag": RSS_ETAG})
+
+# =========================
+# OpenAI Assistants
+# =========================
+assistants = {}
+threads = {}   # thread_id → [message]
+runs = {}      # run_id → run 상태
+
+async def _openai_call(name):
+    _count(f"openai:{name}")
+    await asyncio.sleep(OPENAI_LATENCY)
+
+def _message(thread_id, role, text):
+    return {
+        "id": _new_id("msg"),
+        "object": "thread.message",
+        "created_at": int(time.time()),
+        "thread_id": thread_id,
+        "role": role,
+        "status": "completed",
+        "content": [{"type": "text", "text": {"value": text, "annotations": []}}],
+        "attachments": [],
+        "metadata": {},
+    }
+
+@app.post("/v1/assistants")
+async def create_assistant(request: Request):
+    await _openai_call("assistants.create")
+    body = await request.json()
+    assistant = {"id": _new_id("asst"), "object": "assistant", "created_at": int(time.time()), **body}
+    assistants[assistant["id"]] = assistant
+    return assistant
+
+@app.get("/v1/assistants/{assistant_id}")
+async def retrieve_assistant(assistant_id: str):
+    await _openai_call("assistants.retrieve")
+    if assistant_id not in assistants:
+        return Response(json.dumps({"error": {"message": "not found"}}), status_code=404,
+                        media_type="application/json")
+    return assistants[assistant_id]
+
+@app.post("/v1/assistants/{assistant_id}")
+async def update_assistant(assistant_id: str, request: Request):
+    await _openai_call("assistants.update")
+    assistants.setdefault(assistant_id, {"id": assistant_id, "object": "assistant"})
+    assistants[assistant_id].update(await request.json())
+    return assistants[assistant_id]
+
+@app.post("/v1/threads")
+async def create_thread():
+    await _openai_call("threads.create")
+    thread_id = _new_id("thread")
+    threads[thread_id] = []
+    return {"id": thread_id, "object": "thread", "created_at": int(time.time()), "metadata": {}}
+
+@app.post("/v1/threads/{thread_id}/messages")
+async def create_message(thread_id: str, request: Request):
+    await _openai_call("messages.create")
+    body = await request.json()
+    message = _message(thread_id, body.get("role", "user"), body["content"])
+    threads.setdefault(thread_id, []).append(message)
+    return message
+
+@app.get("/v1/threads/{thread_id}/messages")
+async def list_messages(thread_id: str, limit: int = 20, order: str = "desc"):
+    await _openai_call("messages.list")
+    data = list(threads.get(thread_id, []))
+    if order == "desc":
+        data.reverse()
+    return {"object": "list", "data": data[:limit], "has_more": len(data) > limit}
+
+def _run_object(run):
+    obj = {
+        "id": run["id"],
+        "object": "thread.run",
+        "created_at": run["created_at"],
+        "thread_id": run["thread_id"],
+        "assistant_id": run["assistant_id"],
+        "status": run["status"],
+        "required_action": None,
+        "last_error": None,
+        "model": "stub",
+        "instructions": "",
+        "tools": [],
+    }
+    if run["status"] == "requires_action":
+        obj["required_action"] = {
+            "type": "submit_tool_outputs",
+            "submit_tool_outputs": {"tool_calls": [
+                {"id": call_id, "type": "function",
+                 "function": {"name": name, "arguments": json.dumps(args, ensure_ascii=False)}}
+                for call_id, name, args in run["tool_calls"]
+            ]},
+        }
+    return obj
+
+def _advance(run):
+    """시간이 지난 Run을 다음 상태로 (폴링/스트림 공용)"""
+    if run["status"] not in ("queued", "in_progress") or time.monotonic() < run["ready_at"]:
+        if run["status"] == "queued":
+            run["status"] = "in_progress"
+        return
+    if run["tool_calls"] and not run["tools_done"]:
+        run["status"] = "requires_action"
+        return
+    run["status"] = "completed"
+    run["reply"] = _message(run["thread_id"], "assistant", run["reply_text"])
+    threads[run["thread_id"]].append(run["reply"])
+
+def _run_events(run):
+    """스트림 모드: 현재 단계가 끝날 때까지 기다렸다가 이벤트 전송"""
+    async def body():
+        def sse(event, data):
+            return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+        yield sse("thread.run.in_progress", _run_object(run))
+        await asyncio.sleep(max(run["ready_at"] - time.monotonic(), 0))
+        _advance(run)
+        if run["status"] == "requires_action":
+            yield sse("thread.run.requires_action", _run_object(run))
+        else:
+            yield sse("thread.message.created", run["reply"])
+            text = run["reply_text"]
+            for j in range(0, len(text), 4):
+                yield sse("thread.message.delta", {
+                    "id": run["reply"]["id"], "object": "thread.message.delta",
+                    "delta": {"content": [{"index": 0, "type": "text", "text": {"value": text[j:j + 4]}}]},
+                })
+            yield sse("thread.message.completed", run["reply"])
+            yield sse("thread.run.completed", _run_object(run))
+        yield "event: done\ndata: [DONE]\n\n"
+    return StreamingResponse(body(), media_type="text/event-stream")
+
+@app.post("/v1/threads/{thread_id}/runs")
+async def create_run(thread_id: str, request: Request):
+    await _openai_call("runs.create")
+    body = await request.json()
+    last_user = next((m for m in reversed(threads.get(thread_id, [])) if m["role"] == "user"), None)
+    text = last_user["content"][0]["text"]["value"] if last_user else ""
+    tool_calls = [(_new_id("call"), name, args) for key, name, args in TOOL_TRIGGERS if key in text]
+    run = {
+        "id": _new_id("run"),
+        "created_at": int(time.time()),
+        "thread_id": thread_id,
+        "assistant_id": body.get("assistant_id"),
+        "status": "queued",
+        "ready_at": time.monotonic() + RUN_LATENCY,
+        "tool_calls": tool_calls,
+        "tools_done": False,
+        "reply_text": _pick(text, REPLIES),
+    }
+    runs[run["id"]] = run
+    if body.get("stream"):
+        return _run_events(run)
+    return _run_object(run)
+
+@app.get("/v1/threads/{thread_id}/runs/{run_id}")
+async def retrieve_run(thread_id: str, run_id: str):
+    await _openai_call("runs.retrieve")
+    run = runs[run_id]
+    _advance(run)
+    return _run_object(run)
+
+@app.post("/v1/threads/{thread_id}/runs/{run_id}/submit_tool_outputs")
+async def submit_tool_outputs(thread_id: str, run_id: str, request: Request):
+    await _openai_call("runs.submit_tool_outputs")
+    body = await request.json()
+    run = runs[run_id]
+    outputs = [json.loads(o["output"]) for o in body.get("tool_outputs", [])]
+    # 도구 결과 첫 값으로 짧은 응답 생성
+    first = next((str(v) for o in outputs for v in o.values() if isinstance(v, str)), "")
+    run["reply_text"] = (first[:24] + "だよ！") if first else run["reply_text"]
+    run["tools_done"] = True
+    run["status"] = "in_progress"
+    run["ready_at"] = time.monotonic() + RUN_LATENCY
+    if body.get("stream"):
+        return _run_events(run)
+    return _run_object(run)
+
+# =========================
+# OpenAI Chat Completions
+# =========================
+def _completion_chunk(delta, finish_reason=None):
+    return {
+        "id": "chatcmpl-stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "stub",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    await _openai_call("chat.completions")
+    body = await request.json()
+    messages = body["messages"]
+    last = messages[-1]
+    tool_calls = []
+    if last["role"] == "user" and body.get("tools"):
+        tool_calls = [(_new_id("call"), name, args) for key, name, args in TOOL_TRIGGERS if key in last["content"]]
+    if last["role"] == "tool":
+        # 도구 결과 첫 값으로 짧은 응답 생성 (Assistants 스텁과 동일)
+        outputs = [json.loads(m["content"]) for m in messages if m["role"] == "tool"]
+        first = next((str(v) for o in outputs for v in o.values() if isinstance(v, str)), "")
+        reply = (first[:24] + "だよ！") if first else _pick("", REPLIES)
+    else:
+        user_text = next(m["content"] for m in reversed(messages) if m["role"] == "user")
+        reply = _pick(user_text, REPLIES)
+
+    async def body_stream():
+        def sse(data):
+            return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+        await asyncio.sleep(RUN_LATENCY)
+        if tool_calls:
+            yield sse(_completion_chunk({"role": "assistant", "content": None}))
+            for i, (call_id, name, args) in enumerate(tool_calls):
+                yield sse(_completion_chunk({"tool_calls": [{
+                    "index": i, "id": call_id, "type": "function",
+                    "function": {"name": name, "arguments": ""}}]}))
+                # 인자는 조각으로 나눠 전송
+                arguments = json.dumps(args, ensure_ascii=False)
+                for j in range(0, len(arguments), 8):
+                    yield sse(_completion_chunk({"tool_calls": [{
+                        "index": i, "function": {"arguments": arguments[j:j + 8]}}]}))
+            yield sse(_completion_chunk({}, "tool_calls"))
+        else:
+            yield sse(_completion_chunk({"role": "assistant", "content": ""}))
+            for j in range(0, len(reply), 4):
+                yield sse(_completion_chunk({"content": reply[j:j + 4]}))
+            yield sse(_completion_chunk({}, "stop"))
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(body_stream(), media_type="text/event-stream")
@@ -1,33 +1,158 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from starlette.websockets import WebSocketState
 from pydantic import BaseModel
-from openai import OpenAI
-from io import BytesIO
+from openai import AsyncOpenAI, NotFoundError, OpenAIError, NOT_GIVEN
 from dotenv import load_dotenv
-import os, time, json, requests, urllib.parse
+from contextlib import asynccontextmanager, contextmanager, nullcontext
+import os, sys, time, json, urllib.parse
 import datetime, random, math, pytz, feedparser
-from collections import defaultdict, OrderedDict
-from datetime import datetime, timedelta
+from collections import OrderedDict, deque
+from datetime import datetime
 import threading
+import asyncio
+import struct
+import sqlite3
+import heapq
+import unicodedata
+import bisect
+import logging, logging.handlers
+import queue
+import atexit
+import contextvars
+import uuid
+import httpx
 import re
 import ast
 import operator as op
+import multiprocessing
+from functools import lru_cache, partial
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import inspect
+try:
+    import fcntl  # 워커 간 파일 락 (POSIX)
+except ImportError:
+    fcntl = None
+
+# 기동 시간 측정 기준 (모듈 로드 시작 → lifespan 진입)
+MODULE_LOADED_AT = time.perf_counter()
 
 # .env 파일 로드
 load_dotenv()
 
 # 환경변수에서 API 키 가져오기
-TTS_API = "http://192.168.50.53:8000/speak"
-ANALYZE_API = "http://192.168.50.53:8000/analyze"
+TTS_API = os.getenv("TTS_API", "http://192.168.50.53:8000/speak")
+ANALYZE_API = os.getenv("ANALYZE_API", "http://192.168.50.53:8000/analyze")
+OPENWEATHER_API_URL = os.getenv("OPENWEATHER_API_URL", "http://api.openweathermap.org/data/2.5/weather")
+NHK_NEWS_URL = os.getenv("NHK_NEWS_URL", "https://www3.nhk.or.jp/rss/news/cat0.xml")
+# 배치 감정 분석 엔드포인트 (설정 시 동시 요청을 묶어서 전송)
+ANALYZE_BATCH_API = os.getenv("ANALYZE_BATCH_API")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENWEATHER_API_KEY = os.getenv("OPENWEATHER_API_KEY")
 ASSISTANT_ID = os.getenv("ASSISTANT_ID")
+# 설정 시 rate limit / 스레드 매핑 / 공격 카운터를 SQLite(WAL)에 저장해 워커 간 공유
+# (THREAD_DB_PATH는 이전 이름)
+STATE_DB_PATH = os.getenv("STATE_DB_PATH") or os.getenv("THREAD_DB_PATH")
+# 설정 시 인젝션 규칙을 JSON 파일에서 읽고, 파일이 바뀌면 재로드
+INJECTION_RULES_PATH = os.getenv("INJECTION_RULES_PATH")
 
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY 환경변수를 설정하세요")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
-app = FastAPI()
+# =========================
+# 로깅 (큐 + 백그라운드 스레드)
+# =========================
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# 메시지 종류별 샘플링 비율 (요청 경로의 시끄러운 로그)
+LOG_SAMPLING = os.getenv("LOG_SAMPLING", "run_poll=0.1,tool_args=0.2,tts_payload=0.05,emotion=0.2,shed=0.05")
+LOG_QUEUE_SIZE = 10000
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+class _RequestLogFilter(logging.Filter):
+    """kind별 샘플링 + request id 부여 (호출한 쪽 컨텍스트에서 실행)"""
+    def __init__(self, sampling):
+        super().__init__()
+        self.rates = {}
+        for item in sampling.split(","):
+            if "=" in item:
+                kind, rate = item.split("=", 1)
+                self.rates[kind.strip()] = float(rate)
+    
+    def filter(self, record):
+        rate = self.rates.get(getattr(record, "kind", None), 1.0)
+        if rate < 1.0 and random.random() >= rate:
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """큐가 가득 차면 기다리지 않고 버림"""
+    dropped = 0
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DroppingQueueHandler.dropped += 1
+
+def _setup_logging():
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(
+        "%(asctime)s %(levelname)s rid=%(request_id)s %(message)s"
+    ))
+    # 실제 출력은 백그라운드 스레드에서
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    logger = logging.getLogger("rene")
+    logger.setLevel(LOG_LEVEL.upper())
+    logger.addFilter(_RequestLogFilter(LOG_SAMPLING))
+    logger.addHandler(_DroppingQueueHandler(log_queue))
+    logger.propagate = False
+    return logger
+
+log = _setup_logging()
+
+async_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
+
+# analyze/TTS/weather 백엔드 공용 커넥션 풀 (keep-alive 재사용)
+http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(60.0, connect=5.0),
+    limits=httpx.Limits(
+        max_connections=200,
+        max_keepalive_connections=50,
+        keepalive_expiry=30.0
+    )
+)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Assistant 준비는 백그라운드로 - 끝나기 전까지 /health는 503 (starting)
+    # chat 엔진은 Assistant를 쓰지 않으므로 준비 생략
+    provision_task = assistant_provisioner.start() if ENGINE == "assistants" else None
+    # TTS 서버가 늦게 떠도 기동을 막지 않도록 백그라운드로 생성
+    prerender_task = asyncio.create_task(prerender_safe_responses())
+    housekeeping_task = asyncio.create_task(housekeeping_loop())
+    news_task = asyncio.create_task(news_cache.refresh_loop())
+    startup_seconds = time.perf_counter() - MODULE_LOADED_AT
+    metrics.observe("startup", startup_seconds)
+    log.info(f"[🚀] 기동 완료: {startup_seconds:.3f}s")
+    yield
+    if provision_task is not None:
+        provision_task.cancel()
+    prerender_task.cancel()
+    housekeeping_task.cancel()
+    news_task.cancel()
+    if safe_eval_pool is not None:
+        safe_eval_pool.close()
+    await http_client.aclose()
+    await async_client.close()
+
+app = FastAPI(lifespan=lifespan)
 
 # =========================
 # 보안 모듈: Safe Eval
@@ -42,111 +167,592 @@ ALLOWED_OPS = {
     ast.Mod: op.mod,
 }
 
-def safe_eval(expr, max_value=10**10):
-    """안전한 수식 평가 - eval() 대체"""
-    def _eval(node):
-        if isinstance(node, ast.Constant):  # Python 3.8+
-            if isinstance(node.value, (int, float)):
-                if abs(node.value) > max_value:
-                    raise ValueError("숫자가 너무 큽니다")
-                return node.value
-            else:
+SAFE_EVAL_MAX_LENGTH = 200
+SAFE_EVAL_MAX_NODES = 64
+SAFE_EVAL_MAX_DEPTH = 32
+
+@lru_cache(maxsize=1024)
+def _compile_expr(expr, max_value):
+    """수식 → 검증된 AST (반복되는 수식은 파싱/검증 생략)"""
+    if len(expr) > SAFE_EVAL_MAX_LENGTH:
+        raise ValueError("수식이 너무 깁니다")
+    tree = ast.parse(expr, mode='eval').body
+    nodes = 0
+    stack = [(tree, 1)]
+    while stack:
+        node, depth = stack.pop()
+        nodes += 1
+        if nodes > SAFE_EVAL_MAX_NODES or depth > SAFE_EVAL_MAX_DEPTH:
+            raise ValueError("수식이 너무 복잡합니다")
+        if isinstance(node, ast.Constant):
+            if type(node.value) not in (int, float):
                 raise TypeError("숫자만 허용됩니다")
+            if abs(node.value) > max_value:
+                raise ValueError("숫자가 너무 큽니다")
+        elif isinstance(node, ast.BinOp) and type(node.op) in ALLOWED_OPS:
+            stack.append((node.left, depth + 1))
+            stack.append((node.right, depth + 1))
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in ALLOWED_OPS:
+            stack.append((node.operand, depth + 1))
+        else:
+            raise TypeError(f"지원하지 않는 타입: {type(node)}")
+    return tree
+
+def _check_cost(op_type, left, right, max_bits):
+    """계산 전에 정수 결과 크기(비트)를 추정 - 9**9**9 같은 폭주 차단"""
+    if type(left) is not int or type(right) is not int:
+        return  # float 연산은 즉시 끝남 (넘치면 OverflowError)
+    if op_type is ast.Pow:
+        # 결과 비트 수의 하한 (|left| >= 2**(bit_length-1)) - 넘지 않으면 계산 후 크기 검사에 맡김
+        if right > 0 and abs(left) > 1 and (abs(left).bit_length() - 1) * right + 1 > max_bits:
+            raise ValueError("계산 비용 초과")
+    elif op_type is ast.Mult:
+        if left.bit_length() + right.bit_length() > max_bits + 1:
+            raise ValueError("계산 비용 초과")
+
+def safe_eval(expr, max_value=10**10, max_result=10**100):
+    """안전한 수식 평가 - eval() 대체 (노드 수/깊이/결과 크기 제한)"""
+    max_bits = max_result.bit_length()
+
+    def _eval(node):
+        if isinstance(node, ast.Constant):
+            return node.value
         elif isinstance(node, ast.BinOp):
             left = _eval(node.left)
             right = _eval(node.right)
-            return ALLOWED_OPS[type(node.op)](left, right)
-        elif isinstance(node, ast.UnaryOp):
-            return ALLOWED_OPS[type(node.op)](_eval(node.operand))
+            _check_cost(type(node.op), left, right, max_bits)
+            result = ALLOWED_OPS[type(node.op)](left, right)
         else:
-            raise TypeError(f"지원하지 않는 타입: {type(node)}")
+            result = ALLOWED_OPS[type(node.op)](_eval(node.operand))
+        if type(result) is int and result.bit_length() > max_bits:
+            raise ValueError("계산 결과가 너무 큽니다")
+        return result
     
     try:
-        node = ast.parse(expr, mode='eval')
-        return _eval(node.body)
-    except:
+        return _eval(_compile_expr(expr, max_value))
+    except ValueError:
+        raise
+    except Exception:
         raise ValueError("잘못된 수식입니다")
 
+class SafeEvalPool:
+    """safe_eval을 별도 프로세스에서 실행 - 시간 초과 시 워커를 죽이고 새로 띄움 (fork 환경 전용)"""
+    def __init__(self, workers=1, timeout=1.0):
+        self.workers = workers
+        self.timeout = timeout
+        self.pool = None
+
+    async def evaluate(self, expr):
+        if self.pool is None:
+            self.pool = multiprocessing.get_context("fork").Pool(self.workers)
+        # 시간 초과 시 이 작업을 받은 풀만 종료 (그 사이 새로 띄운 풀의 작업은 건드리지 않음)
+        pool = self.pool
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def _done(result, setter):
+            loop.call_soon_threadsafe(lambda: future.done() or setter(result))
+
+        pool.apply_async(
+            safe_eval, (expr,),
+            callback=lambda r: _done(r, future.set_result),
+            error_callback=lambda e: _done(e, future.set_exception)
+        )
+        try:
+            return await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            if self.pool is pool:
+                log.warning(f"[⏰] 계산 시간 초과, 워커 재시작: {expr[:50]}")
+                self.close()
+            raise ValueError("계산 시간 초과")
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+# 0이면 이벤트 루프에서 바로 평가 (비용 제한만으로 충분히 빠름)
+SAFE_EVAL_WORKERS = int(os.getenv("SAFE_EVAL_WORKERS", "0"))
+safe_eval_pool = SafeEvalPool(SAFE_EVAL_WORKERS) if SAFE_EVAL_WORKERS and hasattr(os, "fork") else None
+
+# =========================
+# 공유 상태 저장소 (rate limit / 스레드 매핑 / 공격 카운터)
+# =========================
+class MemoryState:
+    """프로세스 내 상태 저장소 (기본값) - 키별 TTL, 샤드 단위 락"""
+    def __init__(self, shards=16):
+        # 샤드별 {key: (value, expires_at 또는 None)}
+        self.shards = [{} for _ in range(shards)]
+        self.locks = [threading.Lock() for _ in range(shards)]
+
+    def _shard(self, key):
+        idx = hash(key) % len(self.locks)
+        return self.shards[idx], self.locks[idx]
+
+    async def run(self, fn, *args, **kwargs):
+        """저장소를 쓰는 동기 함수 실행 (메모리 연산은 짧으므로 이벤트 루프에서 바로)"""
+        return fn(*args, **kwargs)
+
+    @staticmethod
+    def _live(entry, now):
+        return entry is not None and (entry[1] is None or entry[1] > now)
+
+    def get(self, key):
+        data, _ = self._shard(key)
+        entry = data.get(key)
+        return entry[0] if self._live(entry, time.time()) else None
+
+    def set(self, key, value, ttl=None):
+        data, lock = self._shard(key)
+        with lock:
+            data[key] = (value, time.time() + ttl if ttl else None)
+
+    def set_if_absent(self, key, value, ttl=None):
+        """키가 없을 때만 저장 → 저장된 값 (먼저 쓴 쪽이 이김)"""
+        data, lock = self._shard(key)
+        now = time.time()
+        with lock:
+            entry = data.get(key)
+            if self._live(entry, now):
+                return entry[0]
+            data[key] = (value, now + ttl if ttl else None)
+            return value
+
+    def incr(self, key, amount=1, ttl=None):
+        """원자적 증가 → 새 값 (TTL은 키가 새로 생길 때만 설정)"""
+        data, lock = self._shard(key)
+        now = time.time()
+        with lock:
+            entry = data.get(key)
+            if self._live(entry, now):
+                value, expires_at = entry[0] + amount, entry[1]
+            else:
+                value, expires_at = amount, now + ttl if ttl else None
+            data[key] = (value, expires_at)
+            return value
+
+    def update(self, key, fn, ttl=None):
+        """원자적 read-modify-write: fn(현재 값 또는 None) → (새 값, 반환값), 쓸 때마다 TTL 갱신"""
+        data, lock = self._shard(key)
+        now = time.time()
+        with lock:
+            entry = data.get(key)
+            value, result = fn(entry[0] if self._live(entry, now) else None)
+            data[key] = (value, now + ttl if ttl else None)
+            return result
+
+    def delete(self, key):
+        data, lock = self._shard(key)
+        with lock:
+            data.pop(key, None)
+
+    def count(self, prefix):
+        now = time.time()
+        return sum(
+            1 for data in self.shards for key, entry in list(data.items())
+            if key.startswith(prefix) and self._live(entry, now)
+        )
+
+    def purge_expired(self):
+        """만료된 키 삭제 → 삭제 수"""
+        now = time.time()
+        purged = 0
+        for data, lock in zip(self.shards, self.locks):
+            with lock:
+                expired = [key for key, entry in data.items() if not self._live(entry, now)]
+                for key in expired:
+                    del data[key]
+                purged += len(expired)
+        return purged
+
+class SQLiteState:
+    """워커 간 공유 상태 저장소 (SQLite WAL) - 같은 호스트의 여러 uvicorn 워커용
+
+    값은 JSON으로 저장하고, 읽고-쓰는 연산은 BEGIN IMMEDIATE 트랜잭션으로 워커 간 원자성 보장.
+    """
+    def __init__(self, path, busy_timeout=5.0):
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                                    timeout=busy_timeout)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS state_expires ON state (expires_at)")
+        self.lock = threading.Lock()
+        # 비동기 코드는 run()으로 이 스레드에서 호출 (다른 워커와의 잠금 대기가 이벤트 루프를 막지 않게)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite-state")
+
+    async def run(self, fn, *args, **kwargs):
+        """저장소를 쓰는 동기 함수를 전용 스레드에서 실행 (contextvars 유지)"""
+        ctx = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, partial(ctx.run, fn, *args, **kwargs)
+        )
+
+    def _read(self, key, now):
+        row = self.conn.execute(
+            "SELECT value, expires_at FROM state WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] <= now):
+            return None
+        return json.loads(row[0])
+
+    def _write(self, key, value, expires_at):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO state VALUES (?, ?, ?)",
+            (key, json.dumps(value), expires_at)
+        )
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield time.time()
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def get(self, key):
+        with self.lock:
+            return self._read(key, time.time())
+
+    def set(self, key, value, ttl=None):
+        with self.lock:
+            self._write(key, value, time.time() + ttl if ttl else None)
+
+    def set_if_absent(self, key, value, ttl=None):
+        with self._transaction() as now:
+            current = self._read(key, now)
+            if current is not None:
+                return current
+            self._write(key, value, now + ttl if ttl else None)
+            return value
+
+    def incr(self, key, amount=1, ttl=None):
+        with self._transaction() as now:
+            row = self.conn.execute(
+                "SELECT value, expires_at FROM state WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and (row[1] is None or row[1] > now):
+                value, expires_at = json.loads(row[0]) + amount, row[1]
+            else:
+                value, expires_at = amount, now + ttl if ttl else None
+            self._write(key, value, expires_at)
+            return value
+
+    def update(self, key, fn, ttl=None):
+        with self._transaction() as now:
+            value, result = fn(self._read(key, now))
+            self._write(key, value, now + ttl if ttl else None)
+            return result
+
+    def delete(self, key):
+        with self.lock:
+            self.conn.execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def count(self, prefix):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM state WHERE key >= ? AND key < ? "
+                "AND (expires_at IS NULL OR expires_at > ?)",
+                (prefix, prefix + "\uffff", time.time())
+            ).fetchone()[0]
+
+    def purge_expired(self):
+        with self.lock:
+            return self.conn.execute(
+                "DELETE FROM state WHERE expires_at <= ?", (time.time(),)
+            ).rowcount
+
 # =========================
 # Rate Limiter
 # =========================
+class _Bucket:
+    __slots__ = ("tokens", "updated")
+    
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
 class RateLimiter:
-    def __init__(self, max_requests=10, window_minutes=1):
-        self.requests = defaultdict(list)
-        self.max_requests = max_requests
-        self.window = timedelta(minutes=window_minutes)
-        self.lock = threading.Lock()
+    """토큰 버킷 - 사용자당 O(1) 상태
+
+    프로세스 내 저장소(MemoryState)면 샤드별 슬롯 버킷을 직접 보관하고,
+    워커 간 공유 저장소면 (남은 토큰, 갱신 시각)을 저장소의 update()로 원자적으로 갱신.
+    """
+    def __init__(self, max_requests=10, window_minutes=1, tiers=None, state=None, shards=16):
+        # tier → (버킷 용량, 초당 충전량)
+        self.limits = {"default": (max_requests, max_requests / (window_minutes * 60))}
+        for tier, (tier_requests, tier_minutes) in (tiers or {}).items():
+            self.limits[tier] = (tier_requests, tier_requests / (tier_minutes * 60))
+        self.state = None if state is None or isinstance(state, MemoryState) else state
+        # tier → 샤드별 {user_id: _Bucket} (공유 저장소를 쓰면 비어 있음)
+        self.buckets = {tier: [{} for _ in range(shards)] for tier in self.limits}
+        self.locks = [threading.Lock() for _ in range(shards)]
     
-    def is_allowed(self, user_id):
-        with self.lock:
-            now = datetime.now()
-            
-            # 오래된 요청 제거
-            self.requests[user_id] = [
-                req_time for req_time in self.requests[user_id]
-                if now - req_time < self.window
-            ]
+    def is_allowed(self, user_id, tier="default"):
+        if self.state is not None:
+            return self._is_allowed_shared(user_id, tier)
+        capacity, rate = self.limits[tier]
+        idx = hash(user_id) % len(self.locks)
+        now = time.monotonic()
+        
+        with self.locks[idx]:
+            buckets = self.buckets[tier][idx]
+            bucket = buckets.get(user_id)
+            if bucket is None:
+                bucket = buckets[user_id] = _Bucket(capacity, now)
+            else:
+                # 경과 시간만큼 충전
+                bucket.tokens = min(capacity, bucket.tokens + (now - bucket.updated) * rate)
+                bucket.updated = now
             
-            # 요청 수 확인
-            if len(self.requests[user_id]) >= self.max_requests:
+            if bucket.tokens < 1:
                 return False
-            
-            # 새 요청 추가
-            self.requests[user_id].append(now)
+            bucket.tokens -= 1
             return True
+    
+    def _is_allowed_shared(self, user_id, tier):
+        capacity, rate = self.limits[tier]
+        
+        def take(bucket):
+            now = time.time()
+            if bucket is None:
+                tokens = capacity
+            else:
+                tokens = min(capacity, bucket[0] + max(0.0, now - bucket[1]) * rate)
+            if tokens < 1:
+                return (tokens, now), False
+            return (tokens - 1, now), True
+        
+        # 가득 찰 때까지 걸리는 시간이 지나면 새 사용자와 같은 상태 → 만료로 삭제
+        return self.state.update(f"rl:{tier}:{user_id}", take, ttl=capacity / rate)
+    
+    def evict_idle(self):
+        """가득 찬 버킷(=새 사용자와 같은 상태) 제거 → 제거 수 반환 (공유 저장소는 TTL로 만료)"""
+        now = time.monotonic()
+        evicted = 0
+        for tier, (capacity, rate) in self.limits.items():
+            for buckets, lock in zip(self.buckets[tier], self.locks):
+                with lock:
+                    idle = [
+                        user_id for user_id, bucket in buckets.items()
+                        if bucket.tokens + (now - bucket.updated) * rate >= capacity
+                    ]
+                    for user_id in idle:
+                        del buckets[user_id]
+                    evicted += len(idle)
+        return evicted
+    
+    def __len__(self):
+        if self.state is not None:
+            return self.state.count("rl:")
+        return sum(len(buckets) for shards in self.buckets.values() for buckets in shards)
 
 # =========================
 # Thread Manager
 # =========================
 class ThreadManager:
-    def __init__(self, max_threads=1000, ttl_hours=24):
+    def __init__(self, max_threads=1000, ttl_hours=24, state=None):
+        # 로컬 LRU (상태 저장소 앞단 캐시)
         self.threads = OrderedDict()
         self.max_threads = max_threads
-        self.ttl = timedelta(hours=ttl_hours)
-        self.lock = threading.Lock()
+        self.ttl = ttl_hours * 3600
+        # user_id → [thread_id, 생성 시각] 원본 (워커 간 공유 가능)
+        self.state = state if state is not None else MemoryState()
+        # (만료 시각, user_id, thread_id) 힙 - 전체 스캔 없이 만료 처리
+        self.expiry = []
+        # user_id → 생성 중인 Task (사용자별 1회만 생성)
+        self.pending = {}
     
-    def get_or_create(self, user_id, client):
-        with self.lock:
-            # 오래된 스레드 정리
-            self._cleanup_old_threads()
-            
-            # 기존 스레드 반환
-            if user_id in self.threads:
-                self.threads.move_to_end(user_id)  # LRU 업데이트
-                return self.threads[user_id]['id']
-            
-            # 용량 초과 시 가장 오래된 것 삭제
-            if len(self.threads) >= self.max_threads:
-                oldest_user_id, _ = self.threads.popitem(last=False)
-                print(f"[🗑️] 오래된 스레드 삭제: {oldest_user_id}")
-            
-            # 새 스레드 생성
-            thread = client.beta.threads.create()
-            self.threads[user_id] = {
-                'id': thread.id,
-                'created_at': datetime.now()
-            }
-            print(f"[🆕] 새 스레드 생성: {user_id} -> {thread.id}")
-            
-            return thread.id
+    async def get_or_create(self, user_id, client):
+        # 만료된 스레드 정리
+        self._expire()
+        
+        # 기존 스레드 반환
+        data = self.threads.get(user_id)
+        if data is not None:
+            self.threads.move_to_end(user_id)  # LRU 업데이트
+            return data['id']
+        
+        # 같은 사용자의 생성 요청은 하나로 합침 (다른 사용자는 기다리지 않음)
+        task = self.pending.get(user_id)
+        if task is None:
+            task = asyncio.create_task(self._load_or_create(user_id, client))
+            self.pending[user_id] = task
+            task.add_done_callback(lambda t: self._finish(user_id, t))
+        # 기다리던 요청이 취소돼도 생성은 계속
+        return await asyncio.shield(task)
+    
+    def _finish(self, user_id, task):
+        self.pending.pop(user_id, None)
+        if not task.cancelled():
+            task.exception()  # 미회수 예외 경고 방지
+    
+    async def _load_or_create(self, user_id, client):
+        key = f"thread:{user_id}"
+        
+        # 다른 워커(또는 이전 프로세스)가 만든 스레드 복원
+        entry = await self.state.run(self.state.get, key)
+        if entry is not None:
+            thread_id, created_at = entry
+            self._remember(user_id, thread_id, created_at)
+            log.info(f"[♻️] 스레드 복원: {user_id} -> {thread_id}")
+            return thread_id
+        
+        # 새 스레드 생성 - 동시에 다른 워커가 먼저 저장했다면 그쪽을 사용 (대화가 갈라지지 않도록)
+        thread = await client.beta.threads.create()
+        thread_id, created_at = await self.state.run(
+            self.state.set_if_absent, key, [thread.id, time.time()], ttl=self.ttl
+        )
+        self._remember(user_id, thread_id, created_at)
+        if thread_id == thread.id:
+            log.info(f"[🆕] 새 스레드 생성: {user_id} -> {thread_id}")
+        else:
+            log.info(f"[🔀] 다른 워커의 스레드 사용: {user_id} -> {thread_id}")
+        
+        return thread_id
     
-    def _cleanup_old_threads(self):
-        now = datetime.now()
-        expired = []
+    def _remember(self, user_id, thread_id, created_at):
+        # 용량 초과 시 가장 오래된 것 삭제
+        if len(self.threads) >= self.max_threads:
+            oldest_user_id, _ = self.threads.popitem(last=False)
+            # 프로세스 내 저장소는 이 캐시의 사본일 뿐이므로 같이 삭제 (max_threads로 메모리 상한 유지)
+            if isinstance(self.state, MemoryState):
+                self.state.delete(f"thread:{oldest_user_id}")
+            log.info(f"[🗑️] 오래된 스레드 삭제: {oldest_user_id}")
         
-        for user_id, data in self.threads.items():
-            if now - data['created_at'] > self.ttl:
-                expired.append(user_id)
+        self.threads[user_id] = {
+            'id': thread_id,
+            'created_at': created_at
+        }
+        heapq.heappush(self.expiry, (created_at + self.ttl, user_id, thread_id))
         
-        for user_id in expired:
-            del self.threads[user_id]
-            print(f"[⏰] 만료된 스레드 삭제: {user_id}")
+        # LRU로 밀려난 항목이 힙에 쌓이지 않도록 주기적으로 재구성
+        if len(self.expiry) > 2 * self.max_threads:
+            self.expiry = [
+                (data['created_at'] + self.ttl, uid, data['id'])
+                for uid, data in self.threads.items()
+            ]
+            heapq.heapify(self.expiry)
+    
+    def _expire(self):
+        now = time.time()
+        while self.expiry and self.expiry[0][0] <= now:
+            _, user_id, thread_id = heapq.heappop(self.expiry)
+            data = self.threads.get(user_id)
+            if data is not None and data['id'] == thread_id:
+                del self.threads[user_id]
+                log.info(f"[⏰] 만료된 스레드 삭제: {user_id}")
+
+# =========================
+# 대화 기록 (chat 엔진)
+# =========================
+def estimate_tokens(text):
+    """토큰 수 추정 - 영문 4자당 1, 일본어/한국어는 1자당 1 (+메시지 오버헤드)"""
+    ascii_chars = sum(1 for c in text if c < "\x80")
+    return (len(text) - ascii_chars) + ascii_chars // 4 + 4
+
+class _History:
+    __slots__ = ("turns", "tokens", "updated")
+
+    def __init__(self):
+        self.turns = deque()  # (user_text, reply, tokens)
+        self.tokens = 0
+        self.updated = 0.0
+
+class HistoryStore:
+    """사용자별 대화 기록 - 턴 수/토큰 예산을 넘으면 오래된 턴부터 버림"""
+    def __init__(self, max_users=1000, max_turns=20, max_tokens=2000, ttl_hours=24):
+        self.users = OrderedDict()
+        self.max_users = max_users
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.ttl = ttl_hours * 3600
+
+    def messages(self, user_id):
+        """Chat Completions용 메시지 목록 (오래된 순)"""
+        history = self.users.get(user_id)
+        if history is None or time.time() - history.updated > self.ttl:
+            return []
+        self.users.move_to_end(user_id)
+        messages = []
+        for user_text, reply, _ in history.turns:
+            messages.append({"role": "user", "content": user_text})
+            messages.append({"role": "assistant", "content": reply})
+        return messages
+
+    def append(self, user_id, user_text, reply):
+        history = self.users.get(user_id)
+        if history is None:
+            if len(self.users) >= self.max_users:
+                self.users.popitem(last=False)
+            history = self.users[user_id] = _History()
+        else:
+            self.users.move_to_end(user_id)
+
+        tokens = estimate_tokens(user_text) + estimate_tokens(reply)
+        history.turns.append((user_text, reply, tokens))
+        history.tokens += tokens
+        history.updated = time.time()
+        # 마지막 턴은 예산을 넘어도 유지
+        while len(history.turns) > 1 and (
+            len(history.turns) > self.max_turns or history.tokens > self.max_tokens
+        ):
+            history.tokens -= history.turns.popleft()[2]
+
+    def evict_expired(self):
+        """TTL 지난 사용자 기록 삭제, 삭제 수 반환"""
+        cutoff = time.time() - self.ttl
+        expired = [uid for uid, h in self.users.items() if h.updated < cutoff]
+        for uid in expired:
+            del self.users[uid]
+        return len(expired)
+
+    def __len__(self):
+        return len(self.users)
 
 # =========================
 # Injection Defense
 # =========================
+def _keyword_regex(keywords):
+    """키워드 목록 → 공통 접두사를 묶은 정규식 (트라이)"""
+    trie = {}
+    for keyword in keywords:
+        node = trie
+        for ch in keyword:
+            node = node.setdefault(ch, {})
+        node[""] = {}
+    
+    def build(node):
+        branches = [re.escape(ch) + build(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        return f"(?:{body})?" if "" in node else body
+    
+    return build(trie)
+
+def _non_capturing(pattern):
+    # 합친 정규식에서 그룹 번호가 섞이지 않도록
+    return re.sub(r"(?<!\\)\((?!\?)", "(?:", pattern)
+
+class _AttemptLog:
+    """사용자별 공격 시도 기록 (최근 N건, 진단용 - 워커 로컬)"""
+    __slots__ = ("recent", "total")
+    
+    def __init__(self, max_recent):
+        self.recent = deque(maxlen=max_recent)
+        self.total = 0
+
 class InjectionDefense:
-    def __init__(self):
+    def __init__(self, rules_path=None, max_users=10000, max_recent=20,
+                 max_message_chars=200, offender_threshold=5, offender_window_minutes=10,
+                 state=None):
         # 위험 키워드 목록
         self.danger_keywords = [
             # 모델 정보
@@ -172,142 +778,550 @@ class InjectionDefense:
             r"(ignore|無視).*(instruction|指示|rule)"
         ]
         
-        # 공격 시도 로그
-        self.attempts = defaultdict(list)
+        # 규칙 파일 (JSON: {"keywords": [...], "patterns": [...]}) - 변경 시 재로드
+        self.rules_path = rules_path
+        self.rules_mtime = None
+        self._compile_rules()
+        if rules_path:
+            self.reload_rules()
+        
+        # 공격 시도 로그 (user_id → _AttemptLog, 추적 사용자 수 상한 LRU)
+        self.attempts = OrderedDict()
+        self.max_users = max_users
+        self.max_recent = max_recent
+        self.max_message_chars = max_message_chars
+        self.attempts_lock = threading.Lock()
+        
+        # 윈도우 내 시도 횟수가 임계치 이상이면 반복 공격자로 차단 (카운터는 워커 간 공유 가능)
+        self.offender_threshold = offender_threshold
+        self.offender_window = offender_window_minutes * 60
+        self.state = state if state is not None else MemoryState()
+        
+        # 안전한 기본 응답 (기동 시 음성 미리 생성)
+        self.safe_responses = [
+            "その質問には答えられない。他に何か聞きたいことがある？",
+            "普通の質問をして！",
+            "それは答えられない。別の話をしよう！",
+            "その質問は無理だよ。"
+        ]
+    
+    def _compile_rules(self):
+        """키워드 + 패턴을 하나의 정규식으로 컴파일 (입력을 한 번만 스캔)"""
+        keywords = [k.lower() for k in self.danger_keywords]
+        patterns = [re.compile(p) for p in self.danger_patterns]
+        alternatives = [_non_capturing(p) for p in self.danger_patterns]
+        if keywords:
+            alternatives.insert(0, _keyword_regex(keywords))
+        matcher = re.compile("|".join(alternatives)) if alternatives else None
+        # 튜플 한 번에 교체 → 검사 중인 요청은 이전 규칙으로 끝남
+        self.rules = (matcher, frozenset(keywords), patterns)
+    
+    def reload_rules(self) -> bool:
+        """규칙 파일이 바뀌었으면 다시 읽어 교체"""
+        try:
+            mtime = os.path.getmtime(self.rules_path)
+            if mtime == self.rules_mtime:
+                return False
+            with open(self.rules_path, encoding="utf-8") as f:
+                data = json.load(f)
+            keywords = data.get("keywords", self.danger_keywords)
+            patterns = data.get("patterns", self.danger_patterns)
+            for pattern in patterns:
+                re.compile(pattern)
+        except (OSError, ValueError, re.error) as e:
+            log.error(f"[❌] 인젝션 규칙 로드 실패: {str(e)}")
+            return False
+        
+        self.danger_keywords = keywords
+        self.danger_patterns = patterns
+        self._compile_rules()
+        self.rules_mtime = mtime
+        log.info(f"[🔁] 인젝션 규칙 로드: 키워드 {len(keywords)}개, 패턴 {len(patterns)}개")
+        return True
+    
+    def match_rule(self, user_input: str):
+        """매칭된 규칙 이름 반환 (없으면 None)"""
+        matcher, keywords, patterns = self.rules
+        if matcher is None:
+            return None
+        match = matcher.search(user_input.lower())
+        if match is None:
+            return None
+        
+        # 차단된 경우에만 어떤 규칙인지 확인
+        text = match.group()
+        if text in keywords:
+            return f"keyword:{text}"
+        for pattern in patterns:
+            if pattern.fullmatch(text):
+                return f"pattern:{pattern.pattern}"
+        return "unknown"
     
     def is_injection_attempt(self, user_input: str) -> bool:
         """프롬프트 인젝션 시도 감지"""
-        input_lower = user_input.lower()
-        
-        # 키워드 검사
-        for keyword in self.danger_keywords:
-            if keyword in input_lower:
-                return True
+        return self.match_rule(user_input) is not None
+    
+    def log_attempt(self, user_id: str, message: str, rule=None):
+        """공격 시도 로깅 (사용자별 최근 N건, 메시지는 잘라서 보관)"""
+        with self.attempts_lock:
+            entry = self.attempts.get(user_id)
+            if entry is None:
+                # 추적 사용자 수 초과 시 가장 오래된 사용자 삭제
+                if len(self.attempts) >= self.max_users:
+                    self.attempts.popitem(last=False)
+                entry = self.attempts[user_id] = _AttemptLog(self.max_recent)
+            else:
+                self.attempts.move_to_end(user_id)
+            
+            entry.recent.append({
+                'timestamp': datetime.now(),
+                'message': message[:self.max_message_chars],
+                'rule': rule
+            })
+            entry.total += 1
         
-        # 패턴 검사
-        for pattern in self.danger_patterns:
-            if re.search(pattern, input_lower, re.IGNORECASE):
-                return True
+        # 윈도우 카운터는 첫 시도부터 offender_window 동안 유지
+        count = self.state.incr(f"inj:{user_id}", ttl=self.offender_window)
+        self.state.incr("inj:total")
         
-        return False
+        # 임계치 이상 시도 시 경고
+        if count >= self.offender_threshold:
+            log.warning(f"[🚨] 사용자 {user_id}가 여러 번 공격 시도! ({count}회)")
     
-    def log_attempt(self, user_id: str, message: str):
-        """공격 시도 로깅"""
-        self.attempts[user_id].append({
-            'timestamp': datetime.now(),
-            'message': message
-        })
-        
-        # 5번 이상 시도 시 경고
-        if len(self.attempts[user_id]) >= 5:
-            print(f"[🚨] 사용자 {user_id}가 여러 번 공격 시도!")
+    def recent_attempt_count(self, user_id: str) -> int:
+        """현재 윈도우 내 공격 시도 횟수 (O(1))"""
+        return self.state.get(f"inj:{user_id}") or 0
+    
+    @property
+    def total_attempts(self) -> int:
+        return self.state.get("inj:total") or 0
+    
+    def is_repeat_offender(self, user_id: str) -> bool:
+        return self.recent_attempt_count(user_id) >= self.offender_threshold
     
     def get_safe_response(self) -> str:
         """안전한 기본 응답"""
-        responses = [
-            "その質問には答えられない。他に何か聞きたいことがある？",
-            "普通の質問をして！",
-            "それは答えられない。別の話をしよう！",
-            "その質問は無理だよ。"
-        ]
-        return random.choice(responses)
+        return random.choice(self.safe_responses)
+
+# =========================
+# TTS 캐시
+# =========================
+class TTSCache:
+    """바이트 예산 기반 LRU (text + 양자화 감정 + 파라미터 → wav)"""
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entries=2000, emotion_step=0.05):
+        self.items = OrderedDict()
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        # 항목 하나가 캐시 대부분을 차지하지 않도록
+        self.max_item_bytes = max_bytes // 8
+        self.emotion_step = emotion_step
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def make_key(self, payload):
+        emotions = tuple(round(e / self.emotion_step) for e in payload["emotions"])
+        params = tuple(sorted(
+            (k, v) for k, v in payload.items() if k not in ("text", "emotions")
+        ))
+        return (payload["text"], emotions, params)
+    
+    def get(self, key):
+        with self.lock:
+            audio = self.items.get(key)
+            if audio is None:
+                self.misses += 1
+                metrics.incr("cache:tts:miss")
+                return None
+            self.items.move_to_end(key)  # LRU 업데이트
+            self.hits += 1
+            metrics.incr("cache:tts:hit")
+            return audio
+    
+    def put(self, key, audio):
+        if len(audio) > self.max_item_bytes:
+            return
+        with self.lock:
+            old = self.items.pop(key, None)
+            if old is not None:
+                self.total_bytes -= len(old)
+            self.items[key] = audio
+            self.total_bytes += len(audio)
+            
+            # 예산 초과 시 가장 오래된 것부터 삭제
+            while self.total_bytes > self.max_bytes or len(self.items) > self.max_entries:
+                _, evicted = self.items.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+# =========================
+# Metrics
+# =========================
+class Histogram:
+    __slots__ = ("counts", "count", "total")
+    
+    def __init__(self, size):
+        self.counts = [0] * size
+        self.count = 0
+        self.total = 0.0
+
+class Metrics:
+    """단계별 지연 히스토그램 + 카운터
+
+    기록은 이벤트 루프 스레드에서만 하므로 락 없이 고정 버킷에 더하기만 한다.
+    """
+    BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, 60000)
+    
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.started_at = time.time()
+    
+    def observe(self, stage, seconds):
+        hist = self.histograms.get(stage)
+        if hist is None:
+            hist = self.histograms[stage] = Histogram(len(self.BUCKETS_MS) + 1)
+        ms = seconds * 1000
+        hist.counts[bisect.bisect_left(self.BUCKETS_MS, ms)] += 1
+        hist.count += 1
+        hist.total += ms
+    
+    def incr(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+    
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+    
+    def _quantile(self, hist, q):
+        """버킷 상한으로 근사한 분위수 (ms)"""
+        rank = q * hist.count
+        seen = 0
+        for bound, count in zip(self.BUCKETS_MS, hist.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None  # 마지막 버킷 초과
+    
+    def snapshot(self):
+        stages = {}
+        for stage, hist in sorted(self.histograms.items()):
+            if not hist.count:
+                continue
+            stages[stage] = {
+                "count": hist.count,
+                "avg_ms": round(hist.total / hist.count, 1),
+                "p50_ms": self._quantile(hist, 0.50),
+                "p95_ms": self._quantile(hist, 0.95),
+                "p99_ms": self._quantile(hist, 0.99),
+                "buckets": dict(zip([str(b) for b in self.BUCKETS_MS] + ["+inf"], hist.counts))
+            }
+        return {
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "stages": stages,
+            "counters": dict(sorted(self.counters.items()))
+        }
+
+# =========================
+# 다운스트림 동시성 제한 (admission control)
+# =========================
+# 백엔드별 (동시 실행 상한, 대기열 길이, 대기 기한 초) - "tts=4/16/2,openai=32/64/5" 형식으로 일부만 덮어쓰기
+ADMISSION_DEFAULTS = {
+    "tts": (8, 16, 1.0),
+    "analyze": (8, 32, 0.5),
+    "openai": (64, 128, 5.0),
+    "weather": (8, 16, 1.0),
+    "news": (2, 4, 2.0),
+}
+ADMISSION_LIMITS = os.getenv("ADMISSION_LIMITS", "")
+
+def parse_admission_limits(spec):
+    limits = dict(ADMISSION_DEFAULTS)
+    for item in spec.split(","):
+        if "=" in item:
+            name, values = item.split("=", 1)
+            limit, max_queue, timeout = values.split("/")
+            limits[name.strip()] = (int(limit), int(max_queue), float(timeout))
+    return limits
+
+class Overloaded(Exception):
+    """백엔드 대기열이 가득 찼거나 대기 기한 초과 → 503 + Retry-After"""
+    def __init__(self, backend, retry_after):
+        super().__init__(f"{backend} 과부하")
+        self.backend = backend
+        self.retry_after = retry_after
+
+class AdmissionGate:
+    """백엔드별 동시 실행 상한 + 길이 제한 FIFO 대기열
+
+    상한까지는 바로 실행, 넘치면 대기열에서 차례를 기다리고, 대기열이 가득 찼거나
+    대기 기한이 지나면 Overloaded로 즉시 거절해 이미 들어간 요청의 지연을 지킨다.
+    """
+    def __init__(self, name, limit, max_queue, queue_timeout):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiters = deque()  # 차례를 기다리는 Future (release가 슬롯을 그대로 넘김)
+        self.hold_avg = None    # 슬롯 점유 시간 EWMA (초) - Retry-After 추정용
+    
+    def retry_after(self):
+        """대기열이 빠질 때까지의 대략적인 시간 (초, 1 이상)"""
+        hold = self.hold_avg if self.hold_avg is not None else self.queue_timeout
+        return max(1, math.ceil(hold * (len(self.waiters) + 1) / self.limit))
+    
+    def _reject(self, reason):
+        metrics.incr(f"admission:{self.name}:{reason}")
+        raise Overloaded(self.name, self.retry_after())
+    
+    def check(self):
+        """자리를 잡지 않고 대기열이 가득 찼는지만 확인 (앞단에서 싸게 거절)"""
+        if self.active >= self.limit and len(self.waiters) >= self.max_queue:
+            self._reject("rejected")
+    
+    async def acquire(self):
+        """슬롯 확보 → 확보 시각 (release에 전달)"""
+        start = time.perf_counter()
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+        else:
+            if len(self.waiters) >= self.max_queue:
+                self._reject("rejected")
+            future = asyncio.get_running_loop().create_future()
+            self.waiters.append(future)
+            try:
+                await asyncio.wait({future}, timeout=self.queue_timeout)
+            except asyncio.CancelledError:
+                self._abandon(future)
+                raise
+            if not future.done():
+                self._abandon(future)
+                self._reject("timeout")
+        acquired_at = time.perf_counter()
+        metrics.observe(f"queue:{self.name}", acquired_at - start)
+        return acquired_at
+    
+    def _abandon(self, future):
+        if future.done():
+            self.release()  # 차례를 넘겨받은 직후 취소됨 → 다음 대기자에게
+        else:
+            future.cancel()
+            self.waiters.remove(future)
+    
+    def release(self, acquired_at=None):
+        if acquired_at is not None:
+            held = time.perf_counter() - acquired_at
+            self.hold_avg = held if self.hold_avg is None else 0.9 * self.hold_avg + 0.1 * held
+        while self.waiters:
+            future = self.waiters.popleft()
+            if not future.done():
+                future.set_result(None)  # 슬롯을 그대로 넘김 (active 유지)
+                return
+        self.active -= 1
+    
+    @asynccontextmanager
+    async def slot(self):
+        acquired_at = await self.acquire()
+        try:
+            yield
+        finally:
+            self.release(acquired_at)
+    
+    def snapshot(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "queued": len(self.waiters),
+            "max_queue": self.max_queue,
+            "queue_timeout_s": self.queue_timeout,
+            "hold_avg_ms": round(self.hold_avg * 1000, 1) if self.hold_avg is not None else None,
+        }
 
 # =========================
 # 전역 인스턴스 생성
 # =========================
-rate_limiter = RateLimiter(max_requests=10, window_minutes=1)
-thread_manager = ThreadManager(max_threads=1000, ttl_hours=24)
-defense = InjectionDefense()
+metrics = Metrics()
+shared_state = SQLiteState(STATE_DB_PATH) if STATE_DB_PATH else MemoryState()
+rate_limiter = RateLimiter(max_requests=10, window_minutes=1, state=shared_state)
+thread_manager = ThreadManager(max_threads=1000, ttl_hours=24, state=shared_state)
+history_store = HistoryStore(max_users=1000, max_turns=20, max_tokens=2000, ttl_hours=24)
+defense = InjectionDefense(rules_path=INJECTION_RULES_PATH, state=shared_state)
+tts_cache = TTSCache(max_bytes=64 * 1024 * 1024, max_entries=2000)
+admission = {
+    name: AdmissionGate(name, *limits)
+    for name, limits in parse_admission_limits(ADMISSION_LIMITS).items()
+}
+
+HOUSEKEEPING_INTERVAL = 60  # 초
+
+async def _purge_state():
+    evicted = rate_limiter.evict_idle()
+    if evicted:
+        log.info(f"[🧹] 유휴 rate limit 버킷 정리: {evicted}")
+    purged = await shared_state.run(shared_state.purge_expired)
+    if purged:
+        log.info(f"[🧹] 만료된 상태 정리 (rate limit/스레드/공격 카운터): {purged}")
+
+async def _reload_rules():
+    if defense.rules_path:
+        defense.reload_rules()
+
+async def _evict_history():
+    expired = history_store.evict_expired()
+    if expired:
+        log.info(f"[🧹] 만료된 대화 기록 정리: {expired}")
+
+async def _retry_provision():
+    if ENGINE == "assistants" and not assistant_provisioner.ready:
+        assistant_provisioner.start()
+
+HOUSEKEEPING_STEPS = (_purge_state, _reload_rules, _evict_history, _retry_provision)
+
+async def housekeeping_loop():
+    """주기 작업: 유휴 사용자 상태 정리, 인젝션 규칙 재로드, Assistant 준비 재시도"""
+    while True:
+        await asyncio.sleep(HOUSEKEEPING_INTERVAL)
+        # 한 단계가 실패해도 (예: SQLite 잠금 대기 초과) 나머지 단계와 다음 주기는 계속
+        for step in HOUSEKEEPING_STEPS:
+            try:
+                await step()
+            except Exception as e:
+                metrics.incr("housekeeping:error")
+                log.error(f"[❌] 주기 작업 실패 ({step.__name__}): {type(e).__name__}: {str(e)}")
 
 # =========================
-# Assistant 생성/재사용
+# Assistant 준비 (lifespan에서 지연 실행)
 # =========================
-if ASSISTANT_ID:
-    try:
-        assistant = client.beta.assistants.retrieve(ASSISTANT_ID)
-        print(f"[✅] 기존 Assistant 재사용: {ASSISTANT_ID}")
-    except:
-        print(f"[⚠️] Assistant {ASSISTANT_ID}를 찾을 수 없어 새로 생성합니다")
-        ASSISTANT_ID = None
-
-if not ASSISTANT_ID:
-    assistant = client.beta.assistants.create(
-        name="レネ",
-        instructions=(
-            "君は親切で優しいAIアシスタントだ。"
-            "話し方は砕けていて親しみやすく、フレンドリーに話す。"
-            "常に日本語で返事をして、"
-            "返答は30文字以内の1文で簡潔にする。"
-            "ニュースや天気を伝える時も要点だけを短く伝える。"
-            "必要に応じて、登録されたツールを使って応答する。"
-            "絶対に「にゃん」という語尾は使わない。"
-        ),
-        model="gpt-4o",
-    tools=[
-        {"type": "function", "function": {
-            "name": "analyze_emotion",
-            "description": "テキストから感情ベクトルを推定します。",
-            "parameters": {
-                "type": "object",
-                "properties": {"text": {"type": "string"}},
-                "required": ["text"]
-            }}},
-        {"type": "function", "function": {
-            "name": "get_weather",
-            "description": "日本の現在の天気情報を取得します。",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "location": {"type": "string", "description": "知りたい日本の都市（例：東京、大阪など）"}
-                },
-                "required": ["location"]
-            }}},
-        {"type": "function", "function": {
-            "name": "get_time",
-            "description": "日本の現在時刻を返します。",
-            "parameters": {
-                "type": "object",
-                "properties": {},
-                "required": []
-            }}},
-        {"type": "function", "function": {
-            "name": "get_date",
-            "description": "今日の日付と曜日を返します。",
-            "parameters": {
-                "type": "object",
-                "properties": {},
-                "required": []
-            }}},
-        {"type": "function", "function": {
-            "name": "calculate",
-            "description": "数式を計算します。",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "expression": {"type": "string", "description": "計算したい数式 (例: 5 * (3 + 2))"}
-                },
-                "required": ["expression"]
-            }}},
-        {"type": "function", "function": {
-            "name": "get_fortune",
-            "description": "今日の運勢を占います。",
-            "parameters": {
-                "type": "object",
-                "properties": {},
-                "required": []
-            }}},
-        {"type": "function", "function": {
-            "name": "get_news",
-            "description": "日本の今日のニュース一覧を取得します。",
-            "parameters": {
-                "type": "object",
-                "properties": {},
-                "required": []
-            }}}
-        ]
-    )
-    print(f"[🆕] 새 Assistant 생성: {assistant.id}")
-    print(f"[💡] .env 파일에 ASSISTANT_ID={assistant.id} 추가하세요")
+ASSISTANT_NAME = "レネ"
+ASSISTANT_MODEL = "gpt-4o"
+ASSISTANT_INSTRUCTIONS = (
+    "君は親切で優しいAIアシスタントだ。"
+    "話し方は砕けていて親しみやすく、フレンドリーに話す。"
+    "常に日本語で返事をして、"
+    "返答は30文字以内の1文で簡潔にする。"
+    "ニュースや天気を伝える時も要点だけを短く伝える。"
+    "必要に応じて、登録されたツールを使って応答する。"
+    "絶対に「にゃん」という語尾は使わない。"
+)
+# 워커 간 공유하는 준비 결과 (assistant_id + fingerprint), 옆에 .lock 파일로 배타 실행
+ASSISTANT_STATE_PATH = os.getenv(
+    "ASSISTANT_STATE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".assistant_state.json")
+)
+
+def assistant_spec():
+    return {
+        "name": ASSISTANT_NAME,
+        "model": ASSISTANT_MODEL,
+        "instructions": ASSISTANT_INSTRUCTIONS,
+        "tools": tool_registry.schemas(),
+    }
+
+def assistant_fingerprint():
+    """instructions/tool 스키마 해시 - 바뀌었을 때만 update"""
+    spec = json.dumps(assistant_spec(), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(spec.encode("utf-8")).hexdigest()[:16]
+
+class AssistantProvisioner:
+    """Assistant 생성/재사용/갱신을 기동 후 한 번만 실행 (워커 간 파일 락)"""
+    def __init__(self, assistant_id=None, state_path=ASSISTANT_STATE_PATH):
+        self.configured_id = assistant_id
+        self.state_path = state_path
+        self.fingerprint = None
+        self.assistant_id = None
+        self.error = None
+        self.elapsed = None
+        self.task = None
+
+    @property
+    def ready(self):
+        return self.assistant_id is not None
+
+    def start(self):
+        """준비 태스크 시작 (실패로 끝났으면 재시도)"""
+        if self.task is None or (self.task.done() and not self.ready):
+            self.task = asyncio.create_task(self._provision())
+        return self.task
+
+    async def get_id(self):
+        """준비 완료까지 대기 후 assistant_id (실패 시 RunError)"""
+        if self.ready:
+            return self.assistant_id
+        await asyncio.shield(self.start())
+        if not self.ready:
+            raise RunError(f"Assistant 준비 실패: {self.error}")
+        return self.assistant_id
+
+    async def _provision(self):
+        start = time.perf_counter()
+        try:
+            with open(self.state_path + ".lock", "a") as lock_file:
+                # 먼저 잡은 워커가 생성/갱신하고, 나머지는 저장된 결과를 재사용
+                if fcntl is not None:
+                    await asyncio.to_thread(fcntl.flock, lock_file, fcntl.LOCK_EX)
+                self.assistant_id = await self._sync()
+            self.error = None
+        except (OpenAIError, OSError) as e:
+            self.error = str(e)
+            log.error(f"[❌] Assistant 준비 실패: {e}")
+        finally:
+            self.elapsed = time.perf_counter() - start
+            metrics.observe("assistant_provision", self.elapsed)
+        if self.ready:
+            log.info(f"[⏱️] Assistant 준비 완료: {self.elapsed:.2f}s")
+
+    async def _sync(self):
+        # 도구 등록이 끝난 뒤 계산 (스키마는 tool_registry에서 생성)
+        self.fingerprint = assistant_fingerprint()
+        state = self._load_state()
+        assistant_id = self.configured_id or state.get("assistant_id")
+        if (assistant_id and state.get("assistant_id") == assistant_id
+                and state.get("fingerprint") == self.fingerprint):
+            log.info(f"[✅] 기존 Assistant 재사용 (설정 변경 없음): {assistant_id}")
+            return assistant_id
+
+        assistant = None
+        if assistant_id:
+            try:
+                assistant = await async_client.beta.assistants.retrieve(assistant_id)
+            except NotFoundError:
+                log.warning(f"[⚠️] Assistant {assistant_id}를 찾을 수 없어 새로 생성합니다")
+
+        metadata = {"fingerprint": self.fingerprint}
+        if assistant is None:
+            assistant = await async_client.beta.assistants.create(**assistant_spec(), metadata=metadata)
+            log.info(f"[🆕] 새 Assistant 생성: {assistant.id}")
+            log.info(f"[💡] .env 파일에 ASSISTANT_ID={assistant.id} 추가하세요")
+        elif (assistant.metadata or {}).get("fingerprint") != self.fingerprint:
+            assistant = await async_client.beta.assistants.update(
+                assistant.id, **assistant_spec(), metadata=metadata
+            )
+            log.info(f"[🔧] Assistant 설정 갱신: {assistant.id}")
+        else:
+            log.info(f"[✅] 기존 Assistant 재사용: {assistant.id}")
+
+        self._save_state(assistant.id)
+        return assistant.id
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_state(self, assistant_id):
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"assistant_id": assistant_id, "fingerprint": self.fingerprint}, f)
+        os.replace(tmp_path, self.state_path)
+
+assistant_provisioner = AssistantProvisioner(ASSISTANT_ID)
 
 # =========================
 # API 모델
@@ -338,341 +1352,1626 @@ def get_fortune():
         "message": f"今日の運勢は{fortune}！ラッキーアイテムは{lucky_item}。"
     }
 
-def get_news():
-    """日本のニュースを取得"""
-    try:
-        # NHKニュースRSSフィード
-        feed_url = "https://www3.nhk.or.jp/rss/news/cat0.xml"
-        feed = feedparser.parse(feed_url)
-        
-        if not feed.entries:
-            return {"news": [], "summary": "ニュースが取得できなかった"}
-        
-        # 最新5件のニュースを取得
-        news_items = []
-        for entry in feed.entries[:5]:
-            news_items.append({
-                "title": entry.title,
-                "link": entry.link,
-                "published": entry.get('published', '不明')
-            })
-        
-        # 最初のニュースタイトルを要約として使用
-        summary = f"最新: {feed.entries[0].title[:20]}..."
-        
-        return {
-            "news": news_items,
-            "summary": summary
-        }
-    except Exception as e:
-        print(f"[❌] ニュース取得エラー: {str(e)}")
-        return {"news": [], "summary": "ニュース取得エラー"}
-
-# =========================
-# メインエンドポイント
-# =========================
-@app.post("/chat-agent")
-def chat_agent(req: ChatRequest):
-    user_id = req.user_id
-    user_input = req.message
+def build_news(feed):
+    """フィード → 最新5件 + 要約"""
+    if not feed.entries:
+        return None
     
-    # Rate limiting 체크
-    if not rate_limiter.is_allowed(user_id):
-        raise HTTPException(
-            status_code=429, 
-            detail="要求が多すぎます。少し待ってから再試行してください。"
-        )
+    # 最新5件のニュースを取得
+    news_items = []
+    for entry in feed.entries[:5]:
+        news_items.append({
+            "title": entry.title,
+            "link": entry.link,
+            "published": entry.get('published', '不明')
+        })
     
-    # 프롬프트 인젝션 검사
-    if defense.is_injection_attempt(user_input):
-        defense.log_attempt(user_id, user_input)
-        print(f"[⚠️] 인젝션 시도 감지: {user_id} - {user_input}")
-        
-        # 안전한 응답 즉시 반환
-        safe_response = defense.get_safe_response()
+    # 最初のニュースタイトルを要約として使用
+    summary = f"最新: {feed.entries[0].title[:20]}..."
+    
+    return {
+        "news": news_items,
+        "summary": summary
+    }
+
+class NewsCache:
+    """NHKニュースRSSキャッシュ (バックグラウンド更新 + 条件付きGET)"""
+    def __init__(self, url, ttl_seconds=300):
+        self.url = url
+        self.ttl = ttl_seconds
+        self.result = None
+        self.updated_at = 0
+        self.etag = None
+        self.last_modified = None
+        self.lock = asyncio.Lock()
+    
+    async def refresh(self):
+        """フィード更新 (失敗時は前回の結果を維持)"""
+        headers = {}
+        if self.etag:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified:
+            headers["If-Modified-Since"] = self.last_modified
         
-        # TTS 생성하여 반환
-        tts_payload = {
-            "text": safe_response,
-            "language": "ja",
-            "emotions": [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0],  # 중립
-            "cfg_scale": 5,
-            "speaking_rate": 15,
-            "pitch_std": 100,
-            "vq_score": 0.85,
-            "dnsmos": 4.5
-        }
+        try:
+            async with admission["news"].slot():
+                res = await http_client.get(self.url, headers=headers, timeout=10)
+            if res.status_code == 304:
+                # 変更なし → パース不要
+                self.updated_at = time.time()
+                metrics.incr("news:not_modified")
+                return
+            if res.status_code != 200:
+                log.error(f"[❌] ニュース取得エラー: HTTP {res.status_code}")
+                return
+            
+            feed = await asyncio.to_thread(feedparser.parse, res.content)
+            result = build_news(feed)
+            if result is None:
+                log.warning("[⚠️] ニュースが空のため前回の結果を維持")
+                return
+            self.result = result
+            self.etag = res.headers.get("ETag")
+            self.last_modified = res.headers.get("Last-Modified")
+            self.updated_at = time.time()
+        except Exception as e:
+            log.error(f"[❌] ニュース取得エラー: {str(e)}")
+    
+    async def refresh_loop(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.ttl)
+    
+    async def get(self):
+        """キャッシュ済みニュース (未取得時のみその場で取得)"""
+        if self.result is None:
+            async with self.lock:
+                if self.result is None:
+                    await self.refresh()
+        if self.result is None:
+            metrics.incr("cache:news:miss")
+            return {"news": [], "summary": "ニュース取得エラー"}
+        metrics.incr("cache:news:hit")
+        return self.result
+
+news_cache = NewsCache(NHK_NEWS_URL, ttl_seconds=300)
+
+async def get_news():
+    """日本のニュースを取得"""
+    return await news_cache.get()
+
+def get_time():
+    """日本の現在時刻"""
+    jst = datetime.now(pytz.timezone("Asia/Tokyo"))
+    timestr = jst.strftime("%p %I時%M分").replace("AM", "午前").replace("PM", "午後")
+    return {"time": f"今は{timestr}。"}
+
+def get_date():
+    """今日の日付と曜日"""
+    jst = datetime.now(pytz.timezone("Asia/Tokyo"))
+    datestr = jst.strftime("%Y年%m月%d日（%A）")
+    ja_day = datestr.replace("Monday", "月曜日").replace("Tuesday", "火曜日").replace("Wednesday", "水曜日").replace("Thursday", "木曜日").replace("Friday", "金曜日").replace("Saturday", "土曜日").replace("Sunday", "日曜日")
+    return {"date": f"今日は{ja_day}。"}
+
+async def fetch_weather(location):
+    """OpenWeatherMap 조회 → {"weather", "temp"} (실패 시 None)"""
+    # URL 인코딩 처리
+    encoded_location = urllib.parse.quote(location)
+    url = f"{OPENWEATHER_API_URL}?q={encoded_location},JP&appid={OPENWEATHER_API_KEY}&units=metric&lang=ja"
+    log.debug("[🌐] Weather API 요청: %s", location)
+    
+    async with admission["weather"].slot():
+        res = await http_client.get(url, timeout=10)
+    log.info(f"[📡] Weather API Status: {res.status_code}")
+    
+    if res.status_code != 200:
+        error_data = res.json() if res.text else {}
+        log.error(f"[❌] Weather API Error: {error_data}")
+        return None
+    data = res.json()
+    return {
+        "weather": data["weather"][0]["description"],
+        "temp": round(data["main"]["temp"], 0)  # 소수점 제거
+    }
+
+class WeatherCache:
+    """都市別天気キャッシュ (TTL + stale-while-revalidate + 同時リクエスト合流)"""
+    def __init__(self, ttl_seconds=600, stale_seconds=1800, max_cities=500):
+        self.entries = OrderedDict()  # city → (data, fetched_at)
+        self.ttl = ttl_seconds
+        self.stale = stale_seconds
+        self.max_cities = max_cities
+        # city → 조회 중인 Task (같은 도시는 업스트림 1회만)
+        self.pending = {}
+    
+    @staticmethod
+    def normalize(location):
+        return unicodedata.normalize("NFKC", location).strip().lower()
+    
+    async def get(self, location):
+        city = self.normalize(location)
+        entry = self.entries.get(city)
+        if entry is not None:
+            data, fetched_at = entry
+            age = time.time() - fetched_at
+            if age < self.ttl:
+                metrics.incr("cache:weather:hit")
+                return data
+            if age < self.ttl + self.stale:
+                # 오래된 값을 바로 반환하고 뒤에서 갱신
+                metrics.incr("cache:weather:stale")
+                self._refresh(city, location)
+                return data
+        metrics.incr("cache:weather:miss")
+        return await asyncio.shield(self._refresh(city, location))
+    
+    def _refresh(self, city, location):
+        task = self.pending.get(city)
+        if task is None:
+            task = asyncio.create_task(self._fetch(city, location))
+            self.pending[city] = task
+            task.add_done_callback(lambda t: self._finish(city, t))
+        return task
+    
+    def _finish(self, city, task):
+        self.pending.pop(city, None)
+        if not task.cancelled() and task.exception() is not None:
+            log.error(f"[❌] Weather 갱신 실패: {city} - {task.exception()}")
+    
+    async def _fetch(self, city, location):
+        data = await fetch_weather(location)
+        if data is not None:
+            self.entries[city] = (data, time.time())
+            self.entries.move_to_end(city)
+            if len(self.entries) > self.max_cities:
+                self.entries.popitem(last=False)
+        return data
+
+weather_cache = WeatherCache(ttl_seconds=600, stale_seconds=1800)
+
+async def get_weather(location):
+    """日本の現在の天気 (30文字以内)"""
+    try:
+        data = await weather_cache.get(location)
+    except Exception as e:
+        log.error(f"[❌] Weather Exception: {str(e)}")
+        return "天気取得失敗"
+    
+    if data is None:
+        return f"{location}の天気不明"
+    # 간단한 응답 (30자 이내)
+    return f"{location}は{data['weather']}、{data['temp']}℃だよ"
+
+# =========================
+# 감정 분석 / TTS 백엔드
+# =========================
+# 감정 라벨 순서 정의 (tts_app.py와 일치)
+# tts_app.py 순서: ["기쁨", "슬픔", "분노", "두려움", "놀라움", "혐오", "중립", "기타"]
+ORDERED_KEYS = ["기쁨", "슬픔", "분노", "두려움", "놀라움", "혐오", "중립", "기타"]
+NEUTRAL_EMOTION = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0]
+
+def to_emotion_vec(emotion_data):
+    """all_scores → ORDERED_KEYS 순서의 감정 벡터"""
+    all_scores = emotion_data["all_scores"]
+    return [round(all_scores.get(k, 0.0), 3) for k in ORDERED_KEYS]
+
+class EmotionClient:
+    """감정 분석 클라이언트 - 동시 요청 마이크로 배칭 + 결과 메모이즈
+
+    batch_url이 있으면 window 동안 모인 텍스트를 한 번에 보낸다.
+    (POST {"texts": [...]} → {"results": [{"emotion", "all_scores"} | null, ...]})
+    """
+    def __init__(self, url, batch_url=None, window_ms=5, max_batch=16,
+                 cache_size=2048, max_cached_chars=100, timeout=3.0):
+        self.url = url
+        self.timeout = timeout  # 기다리는 쪽의 상한 (초) - 넘으면 None
+        self.batch_url = batch_url
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        # text → (data, vec) - 짧은 텍스트(정형 응답, 인사말)만 보관
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.max_cached_chars = max_cached_chars
+        # text → 결과를 기다리는 Future (같은 텍스트는 1회만 요청)
+        self.pending = {}
+        self.queue = []
+        self.flush_handle = None
+        # 진행 중인 _send Task (참조가 없으면 실행 도중 GC될 수 있음)
+        self.tasks = set()
+        self.hits = 0
+        self.batches = 0
+    
+    async def analyze(self, text):
+        """텍스트 → (data, ORDERED_KEYS 벡터) (실패 시 None)"""
+        cached = self.cache.get(text)
+        if cached is not None:
+            self.cache.move_to_end(text)
+            self.hits += 1
+            metrics.incr("cache:emotion:hit")
+            return cached
         
-        tts_res = requests.post(TTS_API, json=tts_payload)
-        encoded_reply = urllib.parse.quote(safe_response)
-        response = StreamingResponse(BytesIO(tts_res.content), media_type="audio/wav")
-        response.headers["X-GPT-Reply"] = encoded_reply
-        response.headers["Access-Control-Expose-Headers"] = "X-GPT-Reply"
-        return response
+        future = self.pending.get(text)
+        if future is not None:
+            metrics.incr("cache:emotion:coalesced")
+        else:
+            metrics.incr("cache:emotion:miss")
+            future = asyncio.get_running_loop().create_future()
+            # 기다리던 쪽이 모두 취소돼도 예외 미회수 경고가 나지 않도록
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self.pending[text] = future
+            if self.batch_url:
+                self.queue.append(text)
+                self._schedule()
+            else:
+                self._start_send([text])
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            metrics.incr("emotion:timeout")
+            log.warning(f"[⏰] 감정 분석 타임아웃: {text[:30]}")
+            return None
     
-    start_time = time.time()
+    def _schedule(self):
+        if len(self.queue) >= self.max_batch:
+            self._flush()
+        elif self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(self.window, self._flush)
     
-    # 감정 라벨 순서 정의 (tts_app.py와 일치)
-    # tts_app.py 순서: ["기쁨", "슬픔", "분노", "두려움", "놀라움", "혐오", "중립", "기타"]
-    ordered_keys = ["기쁨", "슬픔", "분노", "두려움", "놀라움", "혐오", "중립", "기타"]
+    def _flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        texts, self.queue = self.queue, []
+        if texts:
+            self._start_send(texts)
     
-    # ===== 유저 입력 감정 분석 추가 =====
-    print(f"[📊] 유저 감정 분석 시작: {user_input}")
-    user_emotion_res = requests.post(ANALYZE_API, json={"text": user_input})
+    def _start_send(self, texts):
+        task = asyncio.create_task(self._send(texts))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
     
-    if user_emotion_res.status_code != 200:
-        print("[⚠️] 유저 감정 분석 실패, 기본 중립 사용")
-        user_emotion_vec = [0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0]  # 중립
-    else:
-        user_emotion_data = user_emotion_res.json()
-        user_all_scores = user_emotion_data["all_scores"]
-        user_emotion_vec = [round(user_all_scores.get(k, 0.0), 3) for k in ordered_keys]
-        print(f"[🧍] 유저 감정 벡터: {user_emotion_vec}")
-        print(f"[🧍] 유저 주요 감정: {user_emotion_data.get('emotion', '알 수 없음')}")
-    
-    # ThreadManager 사용
-    thread_id = thread_manager.get_or_create(user_id, client)
-    print(f"[🧵] thread_id: {thread_id}")
-
-    # 메시지 전송
-    client.beta.threads.messages.create(
+    async def _send(self, texts):
+        # 어떤 경로로 끝나든 기다리는 Future는 모두 정리 (남으면 같은 텍스트가 영원히 대기)
+        results = {}
+        error = None
+        try:
+            async with admission["analyze"].slot():
+                if len(texts) == 1:
+                    res = await http_client.post(self.url, json={"text": texts[0]})
+                    batch = [res.json() if res.status_code == 200 else None]
+                else:
+                    self.batches += 1
+                    res = await http_client.post(self.batch_url, json={"texts": texts})
+                    batch = res.json()["results"] if res.status_code == 200 else [None] * len(texts)
+            if len(batch) != len(texts):
+                # 어느 결과가 어느 텍스트인지 알 수 없으므로 전부 실패 처리
+                log.error(f"[❌] 감정 분석 배치 응답 길이 불일치: {len(batch)} != {len(texts)}")
+                batch = [None] * len(texts)
+            
+            for text, data in zip(texts, batch):
+                if data is None:
+                    continue
+                try:
+                    result = (data, to_emotion_vec(data))
+                except (KeyError, TypeError, AttributeError) as e:
+                    log.warning(f"[⚠️] 감정 분석 응답 형식 오류: {text[:30]} - {e!r}")
+                    continue
+                results[text] = result
+                if len(text) <= self.max_cached_chars:
+                    self.cache[text] = result
+                    if len(self.cache) > self.cache_size:
+                        self.cache.popitem(last=False)
+        except (httpx.HTTPError, Overloaded) as e:
+            error = e
+        except Exception as e:
+            # 응답 형식 오류 등 → 해당 텍스트는 실패(None)
+            log.error(f"[❌] 감정 분석 응답 처리 오류: {e!r}")
+        finally:
+            for text in texts:
+                future = self.pending.pop(text, None)
+                if future is None or future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(results.get(text))
+
+emotion_client = EmotionClient(ANALYZE_API, batch_url=ANALYZE_BATCH_API)
+
+async def analyze_text(text):
+    """감정 분석 API 호출 (실패 시 None)"""
+    result = await emotion_client.analyze(text)
+    return None if result is None else result[0]
+
+def build_tts_payload(text, emotions):
+    return {
+        "text": text,
+        "language": "ja",
+        "emotions": emotions,
+        "cfg_scale": 5,
+        "speaking_rate": 15,
+        "pitch_std": 100,
+        "vq_score": 0.85,
+        "dnsmos": 4.5
+    }
+
+# 인젝션 차단 응답 음성 (text → wav), 기동 시 미리 생성
+safe_response_audio = {}
+
+async def synthesize(text, emotions):
+    """TTS 요청 → wav bytes (실패 시 None), 동일 요청은 캐시에서 반환"""
+    payload = build_tts_payload(text, emotions)
+    key = tts_cache.make_key(payload)
+    audio = tts_cache.get(key)
+    if audio is not None:
+        log.info(f"[💾] TTS 캐시 적중: {text}")
+        return audio
+
+    async with admission["tts"].slot():
+        with metrics.timer("tts"):
+            tts_res = await http_client.post(TTS_API, json=payload)
+    if tts_res.status_code != 200:
+        metrics.incr("tts:error")
+        return None
+    tts_cache.put(key, tts_res.content)
+    return tts_res.content
+
+async def prerender_safe_responses():
+    """인젝션 차단 응답 음성을 미리 생성해 메모리에 보관"""
+    for text in defense.safe_responses:
+        try:
+            audio = await synthesize(text, NEUTRAL_EMOTION)
+        except (httpx.HTTPError, Overloaded) as e:
+            log.warning(f"[⚠️] 안전 응답 음성 생성 실패: {text} - {str(e)}")
+            continue
+        if audio is not None:
+            safe_response_audio[text] = audio
+    log.info(f"[🔊] 안전 응답 음성 준비: {len(safe_response_audio)}/{len(defense.safe_responses)}")
+
+# "stream": TTS 응답을 받는 대로 전달 / "sentence": 문장 단위로 합성해 순서대로 전달
+TTS_MODE = os.getenv("TTS_MODE", "stream")
+SENTENCE_SPLIT = re.compile(r"(?<=[。！？!?\n])")
+
+async def _iter_cached(audio):
+    yield audio
+
+async def _relay_tts(tts_res, key, acquired_at):
+    """업스트림 TTS 본문을 청크 단위로 전달하면서 캐시용으로 모음 (끝날 때까지 TTS 슬롯 점유)"""
+    chunks = []
+    size = 0
+    try:
+        async for chunk in tts_res.aiter_bytes():
+            yield chunk
+            if chunks is not None:
+                size += len(chunk)
+                chunks.append(chunk)
+                if size > tts_cache.max_item_bytes:
+                    chunks = None  # 캐시 대상 아님
+        if chunks is not None:
+            tts_cache.put(key, b"".join(chunks))
+    finally:
+        admission["tts"].release(acquired_at)
+        await tts_res.aclose()
+
+async def synthesize_stream(text, emotions):
+    """TTS 요청 → wav 청크 async iterator (실패 시 None)"""
+    payload = build_tts_payload(text, emotions)
+    key = tts_cache.make_key(payload)
+    audio = tts_cache.get(key)
+    if audio is not None:
+        log.info(f"[💾] TTS 캐시 적중: {text}")
+        return _iter_cached(audio)
+
+    request = http_client.build_request("POST", TTS_API, json=payload)
+    # 슬롯은 스트림을 끝까지 전달할 때까지 점유 (GPU가 합성 중)
+    acquired_at = await admission["tts"].acquire()
+    try:
+        # 스트리밍 모드에서는 첫 바이트(헤더)까지의 시간
+        with metrics.timer("tts"):
+            tts_res = await http_client.send(request, stream=True)
+    except BaseException:
+        admission["tts"].release(acquired_at)
+        raise
+    if tts_res.status_code != 200:
+        admission["tts"].release(acquired_at)
+        await tts_res.aclose()
+        metrics.incr("tts:error")
+        return None
+    return _relay_tts(tts_res, key, acquired_at)
+
+def split_sentences(text):
+    return [s for s in SENTENCE_SPLIT.split(text) if s.strip()]
+
+class _WavJoiner:
+    """여러 wav 응답을 하나의 스트리밍 wav로 연결
+
+    첫 세그먼트 헤더의 RIFF/data 길이를 미정(0xFFFFFFFF)으로 바꾸고,
+    이후 세그먼트는 헤더를 떼고 PCM 데이터만 이어 붙인다.
+    """
+    def __init__(self):
+        self.first = True
+    
+    async def segment(self, chunks):
+        header = b""
+        in_header = True
+        async for chunk in chunks:
+            if not in_header:
+                yield chunk
+                continue
+            header += chunk
+            idx = header.find(b"data")
+            if idx < 0 or len(header) < idx + 8:
+                continue
+            in_header = False
+            body = header[idx + 8:]
+            if self.first:
+                head = bytearray(header[:idx + 8])
+                struct.pack_into("<I", head, 4, 0xFFFFFFFF)
+                struct.pack_into("<I", head, idx + 4, 0xFFFFFFFF)
+                yield bytes(head)
+            if body:
+                yield body
+        self.first = False
+
+async def synthesize_sentences(text, emotions):
+    """문장 단위 TTS → 순서대로 이어진 wav 스트림 (첫 문장 실패 시 None)"""
+    sentences = split_sentences(text) or [text]
+    first = await synthesize_stream(sentences[0], emotions)
+    if first is None:
+        return None
+    # 나머지 문장은 첫 문장 재생 중에 미리 합성
+    rest = [asyncio.create_task(synthesize(s, emotions)) for s in sentences[1:]]
+    for task in rest:
+        # 중간에 멈추거나 취소돼도 예외 미회수 경고가 나지 않도록
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+
+    async def _stream():
+        joiner = _WavJoiner()
+        try:
+            async for chunk in joiner.segment(first):
+                yield chunk
+            for sentence, task in zip(sentences[1:], rest):
+                try:
+                    audio = await task
+                except (httpx.HTTPError, Overloaded) as e:
+                    log.warning(f"[⚠️] 문장 TTS 오류: {str(e)}")
+                    audio = None
+                if audio is None:
+                    # 마지막으로 성공한 문장까지로 스트림을 정상 종료
+                    log.warning(f"[⚠️] 문장 TTS 실패, 이후 생략: {sentence}")
+                    break
+                async for chunk in joiner.segment(_iter_cached(audio)):
+                    yield chunk
+        finally:
+            for task in rest:
+                task.cancel()
+
+    return _stream()
+
+def audio_response(audio, reply):
+    """음성(bytes 또는 청크 iterator) + X-GPT-Reply 헤더 응답"""
+    encoded_reply = urllib.parse.quote(reply)
+    if isinstance(audio, bytes):
+        audio = _iter_cached(audio)
+    response = StreamingResponse(audio, media_type="audio/wav")
+    response.headers["X-GPT-Reply"] = encoded_reply
+    response.headers["Access-Control-Expose-Headers"] = "X-GPT-Reply"
+    return response
+
+SHARED_STREAM_CLAIM_TIMEOUT = 10.0  # 초: 결과를 받고도 이 시간 안에 읽기 시작하지 않은 구독은 버림
+
+class SharedStream:
+    """청크 iterator 하나를 여러 응답이 처음부터 나눠 받음 (중복 요청 공유용)
+
+    source는 구독자가 다음 청크를 원할 때만 읽고 (역압 유지), 모든 구독자가 지나간 청크는 버림.
+    구독자가 하나면 버퍼에는 전달 중인 청크 하나만 남음. 구독은 결과를 받은 즉시 subscribe()로.
+    """
+    def __init__(self, source, claim_timeout=SHARED_STREAM_CLAIM_TIMEOUT):
+        self.source = source
+        self.chunks = deque()
+        self.base = 0          # chunks[0]의 위치
+        self.positions = {}    # 구독 → 다음에 읽을 위치
+        self.started = set()   # 읽기 시작한 구독
+        self.reading = None    # source에서 다음 청크를 읽는 task
+        self.pulled = False
+        self.closing = None
+        self.done = False
+        self.error = None
+        asyncio.get_running_loop().call_later(claim_timeout, self._drop_unclaimed)
+
+    def subscribe(self):
+        """구독 등록 → 청크 async iterator (등록 시점에 앞부분이 이미 버려졌으면 RuntimeError)"""
+        if self.base > 0 or self.closing is not None:
+            raise RuntimeError("공유 스트림을 처음부터 받을 수 없음")
+        token = object()
+        self.positions[token] = 0
+        return self._iterate(token)
+
+    async def _iterate(self, token):
+        if token not in self.positions:
+            raise RuntimeError("공유 스트림 구독이 만료됨")
+        self.started.add(token)
+        try:
+            while True:
+                pos = self.positions[token]
+                if pos < self.base + len(self.chunks):
+                    chunk = self.chunks[pos - self.base]
+                    self.positions[token] = pos + 1
+                    self._trim()
+                    yield chunk
+                elif self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                else:
+                    if self.reading is None:
+                        self.reading = asyncio.create_task(self._read())
+                    # 기다리던 구독자가 취소돼도 읽기는 다른 구독자를 위해 계속
+                    await asyncio.shield(self.reading)
+        finally:
+            self._leave(token)
+
+    async def _read(self):
+        self.pulled = True
+        try:
+            self.chunks.append(await self.source.__anext__())
+        except StopAsyncIteration:
+            self.done = True
+        except Exception as e:
+            self.error = e
+            self.done = True
+        finally:
+            self.reading = None
+
+    def _trim(self):
+        # 모든 구독자가 지나간 청크는 버림
+        low = min(self.positions.values(), default=self.base + len(self.chunks))
+        while self.base < low:
+            self.chunks.popleft()
+            self.base += 1
+
+    def _leave(self, token):
+        self.positions.pop(token, None)
+        self.started.discard(token)
+        self._trim()
+        if not self.positions and not self.done:
+            self._close()
+
+    def _drop_unclaimed(self):
+        # 결과를 받고도 읽기 시작하지 않은 구독 (응답 전에 끊긴 경우)은 기다리지 않음
+        for token in [t for t in self.positions if t not in self.started]:
+            del self.positions[token]
+        self._trim()
+        if not self.positions and not self.done:
+            self._close()
+
+    def _close(self):
+        # 받을 구독자가 없으면 업스트림을 닫아 TTS 슬롯 반환
+        metrics.incr("shared_stream:abandoned")
+        self.done = True
+        self.error = RuntimeError("공유 스트림이 닫힘")
+        self.closing = asyncio.create_task(self._aclose())
+
+    async def _aclose(self):
+        if self.reading is not None:
+            await asyncio.wait({self.reading})
+        elif not self.pulled:
+            # 시작 전인 async generator는 aclose()해도 finally가 돌지 않음 → 한 번 진행시킨 뒤 닫음
+            try:
+                await self.source.__anext__()
+            except Exception:
+                pass
+        await self.source.aclose()
+
+# =========================
+# 도구 실행 (requires_action 배치)
+# =========================
+class _Tool:
+    __slots__ = ("name", "func", "description", "properties", "required",
+                 "timeout", "cache_ttl", "lock")
+
+    def __init__(self, name, func, description, properties, required, timeout, cache_ttl, lock):
+        self.name = name
+        self.func = func
+        self.description = description
+        self.properties = properties
+        self.required = required
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.lock = lock
+
+class ToolRegistry:
+    """도구 정의 하나로 스키마 + 디스패치 + 정책(타임아웃/동시 실행/결과 캐시)"""
+    def __init__(self, default_timeout=3.0, cache_size=512):
+        self.tools = {}
+        # 느린 도구 하나가 배치 전체를 붙잡지 않도록 타임아웃 미지정 도구도 기본값 적용
+        self.default_timeout = default_timeout
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # (name, args_json) → (expires_at, result)
+        self.pending = {}
+
+    def tool(self, name, description, properties=None, required=(),
+             timeout=None, concurrent=True, cache_ttl=None):
+        """데코레이터: 함수를 도구로 등록 (cache_ttl=None이면 캐시 안 함)"""
+        def decorator(func):
+            self.tools[name] = _Tool(
+                name, func, description, properties or {}, list(required),
+                timeout or self.default_timeout, cache_ttl,
+                None if concurrent else asyncio.Lock()
+            )
+            return func
+        return decorator
+
+    def schemas(self):
+        """Assistant에 등록할 function 스키마"""
+        return [
+            {"type": "function", "function": {
+                "name": t.name,
+                "description": t.description,
+                "parameters": {
+                    "type": "object",
+                    "properties": t.properties,
+                    "required": t.required
+                }}}
+            for t in self.tools.values()
+        ]
+
+    def timeout(self, name):
+        tool = self.tools.get(name)
+        return tool.timeout if tool is not None else self.default_timeout
+
+    async def call(self, name, args):
+        """도구 이름 → 실행 결과(dict), 타임아웃 시 asyncio.TimeoutError"""
+        tool = self.tools.get(name)
+        if tool is None:
+            return {"error": f"知らない機能「{name}」..."}
+        # 스키마에 없는 인자는 무시
+        args = {k: v for k, v in args.items() if k in tool.properties}
+        if tool.cache_ttl is None:
+            return await asyncio.wait_for(self._invoke(tool, args), tool.timeout)
+
+        key = (name, json.dumps(args, sort_keys=True, ensure_ascii=False))
+        entry = self.cache.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.cache.move_to_end(key)
+            metrics.incr(f"cache:tool:{name}:hit")
+            return entry[1]
+
+        # 같은 인자의 동시 호출은 한 번만 실행
+        task = self.pending.get(key)
+        if task is not None:
+            metrics.incr(f"cache:tool:{name}:coalesced")
+        else:
+            metrics.incr(f"cache:tool:{name}:miss")
+            task = asyncio.create_task(asyncio.wait_for(self._invoke(tool, args), tool.timeout))
+            self.pending[key] = task
+            task.add_done_callback(lambda t: self._finish(key, tool, t))
+        return await asyncio.shield(task)
+
+    def _finish(self, key, tool, task):
+        self.pending.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        result = task.result()
+        # 에러 결과는 캐시하지 않음
+        if isinstance(result, dict) and "error" in result:
+            return
+        self.cache[key] = (time.monotonic() + tool.cache_ttl, result)
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def _invoke(self, tool, args):
+        # concurrent=False 도구는 한 번에 하나씩 실행
+        async with tool.lock or nullcontext():
+            result = tool.func(**args)
+            if inspect.isawaitable(result):
+                result = await result
+        return result
+
+tool_registry = ToolRegistry(default_timeout=3.0)
+
+# analyze_emotion은 EmotionClient, get_weather는 WeatherCache가 자체 캐시
+@tool_registry.tool(
+    "analyze_emotion", "テキストから感情ベクトルを推定します。",
+    {"text": {"type": "string"}}, required=["text"],
+    timeout=5.0
+)
+async def tool_analyze_emotion(text=""):
+    t1 = time.time()
+    output = await analyze_text(text)
+    if output is None:
+        return {"error": "感情分析に失敗した..."}
+    log.info("[🎯] 感情分析結果: %s", output, extra={"kind": "emotion"})
+    t2 = time.time()
+    log.info(f"[⏱️] 感情分析所要: {t2 - t1:.2f}s")
+    return output
+
+@tool_registry.tool(
+    "get_weather", "日本の現在の天気情報を取得します。",
+    {"location": {"type": "string", "description": "知りたい日本の都市（例：東京、大阪など）"}},
+    required=["location"],
+    timeout=10.0
+)
+async def tool_get_weather(location="東京"):
+    return {"weather": await get_weather(location)}
+
+tool_registry.tool("get_time", "日本の現在時刻を返します。", timeout=1.0)(get_time)
+tool_registry.tool("get_date", "今日の日付と曜日を返します。", timeout=1.0)(get_date)
+
+@tool_registry.tool(
+    "calculate", "数式を計算します。",
+    {"expression": {"type": "string", "description": "計算したい数式 (例: 5 * (3 + 2))"}},
+    required=["expression"],
+    timeout=1.0, cache_ttl=3600
+)
+async def tool_calculate(expression=""):
+    try:
+        # eval() 대신 safe_eval() 사용 (SAFE_EVAL_WORKERS 설정 시 별도 프로세스)
+        if safe_eval_pool is not None:
+            result = await safe_eval_pool.evaluate(expression)
+        else:
+            result = safe_eval(expression)
+        return {"result": f"{expression} = {result}"}
+    except Exception as e:
+        return {"error": "計算できない..."}
+
+tool_registry.tool("get_fortune", "今日の運勢を占います。", timeout=1.0)(get_fortune)
+tool_registry.tool("get_news", "日本の今日のニュース一覧を取得します。", timeout=8.0, cache_ttl=60)(get_news)
+
+async def run_tool_call(call_id, name, arguments):
+    """tool_call 하나 실행 → {"tool_call_id", "output"}"""
+    timeout = tool_registry.timeout(name)
+    emit("status", stage="tool", name=name)
+    t1 = time.time()
+    try:
+        args = json.loads(arguments or "{}")
+        log.info("[🛠] 호출 함수: %s | 인자: %s", name, args, extra={"kind": "tool_args"})
+        output = await tool_registry.call(name, args)
+    except asyncio.TimeoutError:
+        log.warning(f"[⏰] 도구 타임아웃: {name} ({timeout}s)")
+        metrics.incr(f"tool_timeout:{name}")
+        output = {"error": f"「{name}」が時間切れ..."}
+    except Exception as e:
+        log.error(f"[❌] 도구 실행 오류: {name} - {str(e)}")
+        output = {"error": f"「{name}」が失敗した..."}
+    log.info(f"[⏱️] {name} 소요: {time.time() - t1:.2f}s")
+    metrics.observe(f"tool:{name}", time.time() - t1)
+    return {
+        "tool_call_id": call_id,
+        "output": json.dumps(output)
+    }
+
+async def execute_tool_calls(tool_calls):
+    """배치 내 도구를 병렬 실행 (결과는 tool_calls 순서 유지)"""
+    # 시간 초과한 도구는 에러 결과로 채워 나머지와 함께 제출
+    return list(await asyncio.gather(*(
+        run_tool_call(tool.id, tool.function.name, tool.function.arguments) for tool in tool_calls
+    )))
+
+# =========================
+# 로컬 인텐트 라우터 (LLM 생략)
+# =========================
+# 이 값 이상으로 확신할 때만 LLM을 건너뜀 (1보다 크면 라우터 끔)
+INTENT_THRESHOLD = float(os.getenv("INTENT_THRESHOLD", "0.75"))
+
+# 인텐트 부분을 뺀 나머지에서 무시하는 말 (호칭/어미/부탁 표현)
+INTENT_FILLER = re.compile(
+    r"[\s、。,.!?！？～〜ー…・♪w]|ねえ|ねぇ|教えて(?:ください|くれる|くれ|ほしい)?|知りたい"
+    r"|レネ(?:ちゃん|さん)?|ちょっと|です|だよ|かな|かい|って|の|は|か|ね|よ|な|を|に"
+)
+
+INTENT_PATTERNS = [
+    ("time", r"(?:今|いま)?(?:何時|なんじ)|現在時刻|今の時間"),
+    ("date", r"(?:今日|きょう)(?:は)?(?:何日|なんにち|何曜日?|なんようび)|今日の(?:日付|曜日)|(?:(?:今日|きょう)は?)?何月何日"),
+    ("fortune", r"(?:今日の)?(?:運勢|占い|うらない|おみくじ)(?:を?占って)?|占って"),
+    ("calculate", r"(?P<expr>[\d.+\-*/×÷^%() ]*\d[\d.+\-*/×÷^%() ]*)"
+                  r"(?:を?計算して|は(?:いくつ|何|なに|なん)|って(?:いくつ|何|なに|なん)|=)?"),
+]
+
+# 다른 날/시점을 묻는 말이 있으면 시간/날짜/운세는 오늘 기준 템플릿으로 답하지 않음
+INTENT_RELATIVE_TIME = re.compile(
+    r"明日|あした|あす|昨日|きのう|明後日|あさって|一昨日|おととい|来週|先週|再来週|来月|先月|来年|去年|昨年"
+    r"|[\d一二三四五六七八九十何数]+\s*(?:日|週間?|か月|ヶ月|カ月|年|時間|分)(?:後|前)"
+)
+TODAY_INTENTS = ("time", "date", "fortune")
+
+INTENT_TEMPLATES = {
+    "time": "今は{ampm}{hour}時{minute}分だよ！",
+    "date": "今日は{month}月{day}日、{weekday}だよ！",
+    "fortune": "今日の運勢は{fortune}！ラッキーアイテムは{lucky_item}だよ",
+    "calculate": "{expr}は{result}だよ！",
+    "calculate_short": "答えは{result}だよ！",
+}
+
+WEEKDAYS_JA = ["月曜日", "火曜日", "水曜日", "木曜日", "金曜日", "土曜日", "日曜日"]
+CALC_OPERATORS = re.compile(r"[+\-*/×÷^%]")
+# 날짜로 읽히는 모양은 계산하지 않음 (10/18, 2024-10-18, 2024/10/18)
+CALC_DATE_SHAPE = re.compile(r"\d{1,2}/\d{1,2}|\d{4}[-/]\d{1,2}[-/]\d{1,2}")
+
+class IntentRouter:
+    """시간/날짜/운세/계산 질문은 템플릿으로 즉답 - 확신도가 낮으면 None (LLM으로)"""
+    def __init__(self, threshold=0.75):
+        self.threshold = threshold
+        self.patterns = [(intent, re.compile(pattern)) for intent, pattern in INTENT_PATTERNS]
+
+    def route(self, text):
+        """(intent, reply, confidence) 또는 None"""
+        if self.threshold > 1:
+            return None
+        normalized = unicodedata.normalize("NFKC", text).strip()
+        if not normalized:
+            return None
+
+        best = None
+        relative = INTENT_RELATIVE_TIME.search(normalized) is not None
+        for intent, pattern in self.patterns:
+            if relative and intent in TODAY_INTENTS:
+                continue
+            for match in pattern.finditer(normalized):
+                if not match.group(0).strip():
+                    continue
+                confidence = self._confidence(normalized, match)
+                if intent == "calculate" and (
+                    confidence < 1 or CALC_DATE_SHAPE.fullmatch(match.group("expr").strip())
+                ):
+                    continue  # 수식 말고 남는 말이 있거나 날짜 모양이면 계산 질문이 아님
+                if best is None or confidence > best[2]:
+                    best = (intent, match, confidence)
+        if best is None:
+            return None
+
+        intent, match, confidence = best
+        if confidence < self.threshold:
+            metrics.incr("intent:fallback")
+            return None
+        reply = getattr(self, f"_reply_{intent}")(match)
+        if reply is None:
+            metrics.incr("intent:fallback")
+            return None
+        metrics.incr(f"intent:{intent}")
+        return intent, reply, confidence
+
+    @staticmethod
+    def _confidence(text, match):
+        # 매치 바깥에 의미 있는 말이 얼마나 남는지 (적을수록 확실)
+        rest = text[:match.start()] + text[match.end():]
+        rest = INTENT_FILLER.sub("", rest)
+        return 1 - len(rest) / len(text)
+
+    def _reply_time(self, match):
+        now = datetime.now(pytz.timezone("Asia/Tokyo"))
+        return INTENT_TEMPLATES["time"].format(
+            ampm="午前" if now.hour < 12 else "午後",
+            hour=now.hour % 12 or 12,
+            minute=now.minute
+        )
+
+    def _reply_date(self, match):
+        now = datetime.now(pytz.timezone("Asia/Tokyo"))
+        return INTENT_TEMPLATES["date"].format(
+            month=now.month, day=now.day, weekday=WEEKDAYS_JA[now.weekday()]
+        )
+
+    def _reply_fortune(self, match):
+        fortune = get_fortune()
+        return INTENT_TEMPLATES["fortune"].format(**fortune)
+
+    def _reply_calculate(self, match):
+        expr = match.group("expr").strip()
+        if not CALC_OPERATORS.search(expr):
+            return None
+        try:
+            result = safe_eval(expr.replace("×", "*").replace("÷", "/").replace("^", "**"))
+        except Exception:
+            return None  # 계산 못 하면 LLM에 맡김
+        if isinstance(result, float):
+            result = round(result, 6)
+            if result.is_integer():
+                result = int(result)
+        reply = INTENT_TEMPLATES["calculate"].format(expr=expr, result=result)
+        if len(reply) > 30:
+            reply = INTENT_TEMPLATES["calculate_short"].format(result=result)
+        return reply
+
+intent_router = IntentRouter(threshold=INTENT_THRESHOLD)
+
+# =========================
+# Run 실행 (stream / poll)
+# =========================
+# "assistants": Assistants 스레드/Run / "chat": Chat Completions 스트림 + 로컬 대화 기록
+ENGINE = os.getenv("ENGINE", "assistants")
+# "stream": Assistants 이벤트 스트림 / "poll": 적응형 백오프 폴링 (fallback)
+RUN_MODE = os.getenv("RUN_MODE", "stream")
+RUN_TIMEOUT = 60  # 초
+POLL_MIN_INTERVAL = 0.05
+POLL_MAX_INTERVAL = 1.0
+POLL_BACKOFF = 1.5
+
+# 현재 요청의 진행 이벤트 수신 함수 (WebSocket 턴에서만 설정, HTTP 요청은 None)
+event_sink_var = contextvars.ContextVar("event_sink", default=None)
+
+def emit(event_type, **fields):
+    """진행 이벤트 전달 (status/token/reply/emotion) - 수신자가 없으면 무시"""
+    sink = event_sink_var.get()
+    if sink is not None:
+        sink({"type": event_type, **fields})
+
+class RunError(Exception):
+    """Run이 completed 이외의 상태로 끝남"""
+
+RUN_ERROR_MESSAGES = {
+    "cancelled": "GPT 실행 취소됨",
+    "expired": "GPT 실행 만료됨",
+    "incomplete": "GPT 실행 미완료",
+}
+
+def _run_error(run):
+    metrics.incr(f"run_status:{run.status}")
+    if run.status == "failed":
+        return RunError(f"GPT 실행 실패: {run.last_error}")
+    return RunError(RUN_ERROR_MESSAGES.get(run.status, f"GPT 실행 오류: {run.status}"))
+
+async def fetch_reply(thread_id):
+    """스레드의 최신 Assistant 메시지 (없으면 None)"""
+    with metrics.timer("reply_fetch"):
+        messages = await async_client.beta.threads.messages.list(thread_id=thread_id, order="desc", limit=5)
+    for msg in messages.data:
+        if msg.role == "assistant":
+            return msg.content[0].text.value
+    return None
+
+async def _run_streaming(thread_id, assistant_id):
+    """이벤트 스트림으로 Run 실행 - 상태 변화를 즉시 처리"""
+    stream = await async_client.beta.threads.runs.create(
         thread_id=thread_id,
-        role="user",
-        content=user_input
+        assistant_id=assistant_id,
+        stream=True
     )
-    print(f"[📨] 유저 입력: {user_input}")
+    reply = None
+    while stream is not None:
+        next_stream = None
+        async with stream:
+            async for event in stream:
+                if event.event == "thread.run.requires_action":
+                    log.info("[⚙️] GPT가 function_call 요청함")
+                    metrics.incr("run_status:requires_action")
+                    run = event.data
+                    tool_calls = run.required_action.submit_tool_outputs.tool_calls
+                    tool_outputs = await execute_tool_calls(tool_calls)
+
+                    # 도구 결과 제출 → 이어지는 이벤트는 새 스트림으로 수신
+                    next_stream = await async_client.beta.threads.runs.submit_tool_outputs(
+                        thread_id=thread_id,
+                        run_id=run.id,
+                        tool_outputs=tool_outputs,
+                        stream=True
+                    )
+                    log.info("[📩] GPT에게 function 결과 제출 완료")
+                    break
+                elif event.event == "thread.message.delta":
+                    for part in event.data.delta.content or ():
+                        if part.type == "text" and part.text is not None and part.text.value:
+                            emit("token", text=part.text.value)
+                elif event.event == "thread.message.completed":
+                    if event.data.role == "assistant":
+                        reply = event.data.content[0].text.value
+                elif event.event == "thread.run.completed":
+                    log.info("[✅] Assistant 응답 완료")
+                    metrics.incr("run_status:completed")
+                elif event.event in ("thread.run.failed", "thread.run.cancelled",
+                                     "thread.run.expired", "thread.run.incomplete"):
+                    raise _run_error(event.data)
+                elif event.event == "error":
+                    metrics.incr("run_status:error")
+                    raise RunError(f"GPT 실행 실패: {event.data}")
+        stream = next_stream
 
-    # Run 생성
-    run = client.beta.threads.runs.create(
+    # 스트림에서 메시지를 받지 못한 경우에만 조회
+    if reply is None:
+        reply = await fetch_reply(thread_id)
+    return reply
+
+async def _run_polling(thread_id, assistant_id):
+    """폴링으로 Run 실행 - 수십 ms에서 시작해 점점 간격을 늘림"""
+    run = await async_client.beta.threads.runs.create(
         thread_id=thread_id,
-        assistant_id=assistant.id
+        assistant_id=assistant_id
     )
-
-    # 타임아웃 설정
-    max_wait_time = 60  # 60초 타임아웃
-    wait_count = 0
-    
-    # Run 상태 확인 루프
+    interval = POLL_MIN_INTERVAL
     while True:
-        run = client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
-        print(f"[🔄] run.status: {run.status}")
-        
-        # 타임아웃 체크
-        wait_count += 1
-        if wait_count > max_wait_time:
-            print("[❌] 타임아웃: GPT 응답 대기 시간 초과")
-            return {"error": "GPT 응답 타임아웃"}
+        run = await async_client.beta.threads.runs.retrieve(thread_id=thread_id, run_id=run.id)
+        log.info("[🔄] run.status: %s", run.status, extra={"kind": "run_poll"})
 
         if run.status == "requires_action":
-            print("[⚙️] GPT가 function_call 요청함")
+            log.info("[⚙️] GPT가 function_call 요청함")
+            metrics.incr("run_status:requires_action")
             tool_calls = run.required_action.submit_tool_outputs.tool_calls
-            tool_outputs = []
-
-            for tool in tool_calls:
-                name = tool.function.name
-                args = json.loads(tool.function.arguments)
-                print(f"[🛠] 호출 함수: {name} | 인자: {args}")
-
-                if name == "analyze_emotion":
-                    text = args.get("text", "")
-                    t1 = time.time()
-                    res = requests.post(ANALYZE_API, json={"text": text})
-                    if res.status_code != 200:
-                        tool_outputs.append({
-                            "tool_call_id": tool.id,
-                            "output": json.dumps({"error": "感情分析に失敗した..."})
-                        })
-                    else:
-                        output = res.json()
-                        print(f"[🎯] 感情分析結果: {output}")
-                        t2 = time.time()
-                        print(f"[⏱️] 感情分析所要: {t2 - t1:.2f}s")
-                        tool_outputs.append({
-                            "tool_call_id": tool.id,
-                            "output": json.dumps(output)
-                        })
-
-                elif name == "get_weather":
-                    location = args.get("location", "東京")
-                    try:
-                        # URL 인코딩 처리
-                        encoded_location = urllib.parse.quote(location)
-                        url = f"http://api.openweathermap.org/data/2.5/weather?q={encoded_location},JP&appid={OPENWEATHER_API_KEY}&units=metric&lang=ja"
-                        print(f"[🌐] Weather API URL: {url}")
-                        
-                        res = requests.get(url, timeout=10)
-                        print(f"[📡] Weather API Status: {res.status_code}")
-                        
-                        if res.status_code == 200:
-                            data = res.json()
-                            weather = data["weather"][0]["description"]
-                            temp = round(data["main"]["temp"], 0)  # 소수점 제거
-                            # 간단한 응답 (30자 이내)
-                            result = f"{location}は{weather}、{temp}℃だよ"
-                        else:
-                            error_data = res.json() if res.text else {}
-                            print(f"[❌] Weather API Error: {error_data}")
-                            result = f"{location}の天気不明"
-                    except Exception as e:
-                        print(f"[❌] Weather Exception: {str(e)}")
-                        result = "天気取得失敗"
-                    
-                    tool_outputs.append({
-                        "tool_call_id": tool.id,
-                        "output": json.dumps({"weather": result})
-                    })
-
-                elif name == "get_time":
-                    jst = datetime.now(pytz.timezone("Asia/Tokyo"))
-                    timestr = jst.strftime("%p %I時%M分").replace("AM", "午前").replace("PM", "午後")
-                    tool_outputs.append({
-                        "tool_call_id": tool.id,
-                        "output": json.dumps({"time": f"今は{timestr}。"})
-                    })
-
-                elif name == "get_date":
-                    jst = datetime.now(pytz.timezone("Asia/Tokyo"))
-                    datestr = jst.strftime("%Y年%m月%d日（%A）")
-                    ja_day = datestr.replace("Monday", "月曜日").replace("Tuesday", "火曜日").replace("Wednesday", "水曜日").replace("Thursday", "木曜日").replace("Friday", "金曜日").replace("Saturday", "土曜日").replace("Sunday", "日曜日")
-                    tool_outputs.append({
-                        "tool_call_id": tool.id,
-                        "output": json.dumps({"date": f"今日は{ja_day}。"})
-                    })
-
-                elif name == "calculate":
-                    expr = args.get("expression", "")
-                    try:
-                        # eval() 대신 safe_eval() 사용
-                        result = safe_eval(expr)
-                        tool_outputs.append({
-                            "tool_call_id": tool.id,
-                            "output": json.dumps({"result": f"{expr} = {result}"})
-                        })
-                    except Exception as e:
-                        tool_outputs.append({
-                            "tool_call_id": tool.id,
-                            "output": json.dumps({"error": "計算できない..."})
-                        })
-
-                elif name == "get_fortune":
-                    fortune_result = get_fortune()
-                    tool_outputs.append({
-                        "tool_call_id": tool.id,
-                        "output": json.dumps(fortune_result)
-                    })
-
-                elif name == "get_news":
-                    news_result = get_news()
-                    tool_outputs.append({
-                        "tool_call_id": tool.id,
-                        "output": json.dumps(news_result)
-                    })
-
-                else:
-                    tool_outputs.append({
-                        "tool_call_id": tool.id,
-                        "output": json.dumps({"error": f"知らない機能「{name}」..."})
-                    })
+            tool_outputs = await execute_tool_calls(tool_calls)
 
             # 도구 결과 제출
-            run = client.beta.threads.runs.submit_tool_outputs(
+            run = await async_client.beta.threads.runs.submit_tool_outputs(
                 thread_id=thread_id,
                 run_id=run.id,
                 tool_outputs=tool_outputs
             )
-            print("[📩] GPT에게 function 결과 제출 완료")
+            log.info("[📩] GPT에게 function 결과 제출 완료")
+            interval = POLL_MIN_INTERVAL
             continue
 
         elif run.status == "completed":
-            print("[✅] Assistant 응답 완료")
-            break
-        elif run.status == "failed":
-            print(f"[❌] GPT 실행 실패: {run.last_error}")
-            return {"error": f"GPT 실행 실패: {run.last_error}"}
-        elif run.status == "cancelled":
-            print("[❌] GPT 실행 취소됨")
-            return {"error": "GPT 실행 취소됨"}
-        elif run.status == "expired":
-            print("[❌] GPT 실행 만료됨")
-            return {"error": "GPT 실행 만료됨"}
-
-        time.sleep(1)
-
-    # 응답 메시지 가져오기
-    messages = client.beta.threads.messages.list(thread_id=thread_id)
-    reply = ""
-    for msg in messages.data:
-        if msg.role == "assistant":
-            reply = msg.content[0].text.value
-            print(f"[🤖] GPT 응답: {reply}")
-            break
-    else:
+            log.info("[✅] Assistant 응답 완료")
+            metrics.incr("run_status:completed")
+            return await fetch_reply(thread_id)
+        elif run.status in ("failed", "cancelled", "expired", "incomplete"):
+            raise _run_error(run)
+
+        await asyncio.sleep(interval)
+        interval = min(interval * POLL_BACKOFF, POLL_MAX_INTERVAL)
+
+async def run_assistant(thread_id, assistant_id):
+    """Run 실행 → Assistant 응답 텍스트 (RUN_TIMEOUT 초과 시 asyncio.TimeoutError)"""
+    runner = _run_streaming if RUN_MODE == "stream" else _run_polling
+    return await asyncio.wait_for(runner(thread_id, assistant_id), RUN_TIMEOUT)
+
+# =========================
+# Chat Completions 엔진
+# =========================
+MAX_TOOL_ROUNDS = 3
+
+async def _stream_completion(messages, tools):
+    """스트림 1회 → (텍스트, tool_calls) - tool_call 조각은 index별로 이어 붙임"""
+    stream = await async_client.chat.completions.create(
+        model=ASSISTANT_MODEL,
+        messages=messages,
+        tools=tools,
+        stream=True
+    )
+    parts = []
+    tool_calls = {}
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            parts.append(delta.content)
+            emit("token", text=delta.content)
+        for call in delta.tool_calls or ():
+            entry = tool_calls.setdefault(call.index, {"id": "", "name": "", "arguments": ""})
+            if call.id:
+                entry["id"] = call.id
+            if call.function is not None:
+                entry["name"] += call.function.name or ""
+                entry["arguments"] += call.function.arguments or ""
+    return "".join(parts), [tool_calls[i] for i in sorted(tool_calls)]
+
+async def _run_chat(user_id, user_input):
+    messages = [{"role": "system", "content": ASSISTANT_INSTRUCTIONS}]
+    messages += history_store.messages(user_id)
+    messages.append({"role": "user", "content": user_input})
+    tools = tool_registry.schemas()
+
+    for round_no in range(MAX_TOOL_ROUNDS + 1):
+        # 도구 라운드를 다 쓰면 도구 없이 답하게 함
+        if round_no == MAX_TOOL_ROUNDS:
+            tools = NOT_GIVEN
+        text, tool_calls = await _stream_completion(messages, tools)
+        if not tool_calls:
+            metrics.incr("run_status:completed")
+            return text or None
+
+        log.info("[⚙️] GPT가 function_call 요청함")
+        metrics.incr("run_status:requires_action")
+        messages.append({
+            "role": "assistant",
+            "content": text or None,
+            "tool_calls": [
+                {"id": c["id"], "type": "function",
+                 "function": {"name": c["name"], "arguments": c["arguments"]}}
+                for c in tool_calls
+            ]
+        })
+        outputs = await asyncio.gather(*(
+            run_tool_call(c["id"], c["name"], c["arguments"]) for c in tool_calls
+        ))
+        messages += [
+            {"role": "tool", "tool_call_id": o["tool_call_id"], "content": o["output"]}
+            for o in outputs
+        ]
+    raise RunError("GPT 실행 미완료: 도구 호출 반복 초과")
+
+async def ask_chat(user_id, user_input):
+    """로컬 기록 + Chat Completions 스트림 (턴당 왕복 1회, 도구 사용 시 +1)"""
+    async with admission["openai"].slot():
+        run_start = time.time()
+        try:
+            reply = await asyncio.wait_for(_run_chat(user_id, user_input), RUN_TIMEOUT)
+        except OpenAIError as e:
+            metrics.incr("run_status:failed")
+            raise RunError(f"GPT 실행 실패: {e}")
+    metrics.observe("run_wait", time.time() - run_start)
+    log.info(f"[⏱️] Chat 응답 시간: {time.time() - run_start:.2f}s")
+    if reply:
+        history_store.append(user_id, user_input, reply)
+    return reply
+
+async def analyze_user_emotion(user_input):
+    """유저 입력 감정 벡터 (실패 시 중립)"""
+    log.info(f"[📊] 유저 감정 분석 시작: {user_input}")
+    try:
+        with metrics.timer("user_analyze"):
+            result = await emotion_client.analyze(user_input)
+    except (httpx.HTTPError, Overloaded) as e:
+        log.error(f"[❌] 유저 감정 분석 오류: {str(e)}")
+        result = None
+
+    if result is None:
+        log.warning("[⚠️] 유저 감정 분석 실패, 기본 중립 사용")
+        return NEUTRAL_EMOTION  # 중립
+    user_emotion_data, user_emotion_vec = result
+    log.info("[🧍] 유저 감정: %s %s", user_emotion_data.get('emotion', '알 수 없음'), user_emotion_vec,
+             extra={"kind": "emotion"})
+    return user_emotion_vec
+
+async def ask_assistant(user_id, user_input):
+    """스레드 확보 → 메시지 전송 → Run 실행 → 응답 텍스트"""
+    if ENGINE == "chat":
+        return await ask_chat(user_id, user_input)
+
+    # 기동 직후라면 Assistant 준비를 기다림
+    assistant_id = await assistant_provisioner.get_id()
+
+    # 스레드에 메시지를 남기기 전에 자리를 잡음 (거절돼도 대화 기록이 어긋나지 않도록)
+    async with admission["openai"].slot():
+        try:
+            # ThreadManager 사용
+            with metrics.timer("thread"):
+                thread_id = await thread_manager.get_or_create(user_id, async_client)
+            log.info(f"[🧵] thread_id: {thread_id}")
+
+            # 메시지 전송
+            with metrics.timer("message_create"):
+                await async_client.beta.threads.messages.create(
+                    thread_id=thread_id,
+                    role="user",
+                    content=user_input
+                )
+            log.info(f"[📨] 유저 입력: {user_input}")
+
+            # Run 실행 → 응답 텍스트
+            run_start = time.time()
+            reply = await run_assistant(thread_id, assistant_id)
+        except OpenAIError as e:
+            # chat 엔진과 같이 에러 dict로 (WebSocket 연결이 끊기지 않도록)
+            metrics.incr("run_status:failed")
+            raise RunError(f"GPT 실행 실패: {e}")
+    metrics.observe("run_wait", time.time() - run_start)
+    log.info(f"[⏱️] Run 대기 시간({RUN_MODE}): {time.time() - run_start:.2f}s")
+    return reply
+
+# =========================
+# 사용자별 요청 직렬화 / 중복 제출 공유
+# =========================
+class _InflightEntry:
+    __slots__ = ("task", "waiters", "started", "abandoned")
+
+    def __init__(self):
+        self.task = None
+        self.waiters = 0
+        self.started = False
+        self.abandoned = False
+
+class _UserLane:
+    __slots__ = ("entries", "tail")
+
+    def __init__(self):
+        self.entries = {}  # message → 대기/실행 중 항목
+        self.tail = None   # 마지막으로 들어온 항목의 task
+
+class InflightRegistry:
+    """같은 메시지는 결과 공유, 다른 메시지는 도착 순서대로 하나씩 (사용자별 깊이 제한)"""
+    def __init__(self, max_queue=3, disconnect_poll=0.5):
+        self.lanes = {}
+        self.max_queue = max_queue
+        self.disconnect_poll = disconnect_poll
+
+    async def run(self, user_id, message, factory, request=None):
+        lane = self.lanes.get(user_id)
+        if lane is None:
+            lane = self.lanes[user_id] = _UserLane()
+
+        entry = lane.entries.get(message)
+        if entry is not None and not entry.task.done():
+            metrics.incr("inflight:coalesced")
+            entry.abandoned = False
+        else:
+            if len(lane.entries) >= self.max_queue:
+                metrics.incr("inflight:rejected")
+                raise HTTPException(
+                    status_code=429,
+                    detail="処理中のリクエストが多すぎます。少し待ってから再試行してください。"
+                )
+            entry = _InflightEntry()
+            entry.task = asyncio.create_task(self._run_after(lane.tail, entry, factory))
+            entry.task.add_done_callback(lambda t: self._finish(user_id, message, entry))
+            lane.entries[message] = entry
+            lane.tail = entry.task
+        return await self._wait(entry, request)
+
+    async def _run_after(self, prev, entry, factory):
+        # 앞 요청이 성공/실패/건너뜀 어느 쪽이든 끝날 때까지 대기 (OpenAI 스레드에 Run은 하나만)
+        if prev is not None:
+            await asyncio.wait({prev})
+        if entry.abandoned:
+            metrics.incr("inflight:dropped")
+            return None
+        entry.started = True
+        return await factory()
+
+    async def _wait(self, entry, request):
+        entry.waiters += 1
+        try:
+            while True:
+                done, _ = await asyncio.wait({entry.task}, timeout=self.disconnect_poll)
+                if done:
+                    return entry.task.result()
+                if request is not None and await request.is_disconnected():
+                    metrics.incr("inflight:abandoned")
+                    return Response(status_code=499)
+        finally:
+            entry.waiters -= 1
+            # 아직 시작 전인데 기다리는 요청이 없으면 차례가 와도 실행하지 않음
+            if entry.waiters == 0 and not entry.started:
+                entry.abandoned = True
+
+    def _finish(self, user_id, message, entry):
+        lane = self.lanes.get(user_id)
+        if lane is None:
+            return
+        if lane.entries.get(message) is entry:
+            del lane.entries[message]
+        if not lane.entries:
+            del self.lanes[user_id]
+
+    def depth(self, user_id):
+        lane = self.lanes.get(user_id)
+        return len(lane.entries) if lane is not None else 0
+
+inflight = InflightRegistry(max_queue=3)
+
+# =========================
+# 대화 파이프라인
+# =========================
+async def chat_pipeline(user_id, user_input):
+    """GPT 응답 → 감정 혼합 → TTS, (reply, audio) 또는 에러 dict"""
+    start_time = time.time()
+    
+    # 시간/날짜/운세/계산은 로컬에서 즉답 (확신이 없으면 LLM)
+    routed = intent_router.route(user_input)
+    # 과부하면 아무 작업도 시작하기 전에 거절 (503)
+    if routed is None:
+        admission["openai"].check()
+    admission["tts"].check()
+    
+    # ===== 유저 입력 감정 분석 (백그라운드) =====
+    # 혼합 직전까지 필요 없으므로 스레드 확보/Run 실행과 겹쳐서 실행
+    user_emotion_task = asyncio.create_task(analyze_user_emotion(user_input))
+
+    reply = None
+    emit("status", stage="thinking")
+    try:
+        if routed is not None:
+            intent, reply, confidence = routed
+            log.info(f"[⚡] 로컬 인텐트: {intent} ({confidence:.2f})")
+            if ENGINE == "chat":
+                history_store.append(user_id, user_input, reply)
+        else:
+            reply = await ask_assistant(user_id, user_input)
+    except asyncio.TimeoutError:
+        log.error("[❌] 타임아웃: GPT 응답 대기 시간 초과")
+        metrics.incr("run_status:timeout")
+        return {"error": "GPT 응답 타임아웃"}
+    except RunError as e:
+        log.error(f"[❌] {e}")
+        return {"error": str(e)}
+    finally:
+        # 응답이 없으면 유저 감정 분석 결과도 필요 없음
+        if not reply:
+            user_emotion_task.cancel()
+
+    if not reply:
         return {"error": "응답 없음"}
+    log.info(f"[🤖] GPT 응답: {reply}")
+    # 자막은 감정 분석/TTS를 기다리지 않고 먼저
+    emit("reply", text=reply)
+
+    user_emotion_vec = await user_emotion_task
 
     # Assistant 응답 감정 분석
-    emotion_res = requests.post(ANALYZE_API, json={"text": reply})
-    if emotion_res.status_code != 200:
-        print("[⚠️] Assistant 감정 분석 실패, 유저 감정만 사용")
+    try:
+        with metrics.timer("assistant_analyze"):
+            result = await emotion_client.analyze(reply)
+    except (httpx.HTTPError, Overloaded) as e:
+        log.error(f"[❌] Assistant 감정 분석 오류: {str(e)}")
+        result = None
+    if result is None:
+        log.warning("[⚠️] Assistant 감정 분석 실패, 유저 감정만 사용")
         final_emotion_vec = user_emotion_vec
     else:
-        emotion_data = emotion_res.json()
-        all_scores = emotion_data["all_scores"]
-        assistant_emotion_vec = [round(all_scores.get(k, 0.0), 3) for k in ordered_keys]
-        print(f"[🤖] Assistant 감정 벡터: {assistant_emotion_vec}")
-        print(f"[🤖] Assistant 주요 감정: {emotion_data.get('emotion', '알 수 없음')}")
+        emotion_data, assistant_emotion_vec = result
+        log.info("[🤖] Assistant 감정: %s %s", emotion_data.get('emotion', '알 수 없음'), assistant_emotion_vec,
+                 extra={"kind": "emotion"})
         
         # ===== 감정 벡터 혼합 (유저 30% + Assistant 70%) =====
         final_emotion_vec = [
             round((0.3 * u + 0.7 * a), 3) 
             for u, a in zip(user_emotion_vec, assistant_emotion_vec)
         ]
-        print(f"[🎭] 최종 혼합 감정 벡터: {final_emotion_vec}")
+        log.info("[🎭] 최종 혼합 감정 벡터: %s", final_emotion_vec, extra={"kind": "emotion"})
         
         # 가장 높은 감정 찾기
         max_emotion_idx = final_emotion_vec.index(max(final_emotion_vec))
-        max_emotion_name = ordered_keys[max_emotion_idx]
-        print(f"[🎭] 최종 주요 감정: {max_emotion_name} ({final_emotion_vec[max_emotion_idx]:.3f})")
+        max_emotion_name = ORDERED_KEYS[max_emotion_idx]
+        log.info(f"[🎭] 최종 주요 감정: {max_emotion_name} ({final_emotion_vec[max_emotion_idx]:.3f})")
+    emit("emotion", vector=final_emotion_vec,
+         label=ORDERED_KEYS[final_emotion_vec.index(max(final_emotion_vec))])
+    emit("status", stage="speaking")
 
-    # TTS 요청
-    tts_payload = {
-        "text": reply,
-        "language": "ja",
-        "emotions": final_emotion_vec,  # 혼합된 감정 사용
-        "cfg_scale": 5,
-        "speaking_rate": 15,
-        "pitch_std": 100,
-        "vq_score": 0.85,
-        "dnsmos": 4.5
-    }
-    print(f"[📢] TTS 요청: {tts_payload}")
+    # TTS 요청 (혼합된 감정 사용)
+    log.info("[📢] TTS 요청: %s | emotions: %s", reply, final_emotion_vec, extra={"kind": "tts_payload"})
 
-    tts_res = requests.post(TTS_API, json=tts_payload)
-    if tts_res.status_code != 200:
+    if TTS_MODE == "sentence":
+        audio = await synthesize_sentences(reply, final_emotion_vec)
+    else:
+        audio = await synthesize_stream(reply, final_emotion_vec)
+    if audio is None:
         return {"error": "TTS 생성 실패"}
 
-    # 응답 반환
-    encoded_reply = urllib.parse.quote(reply)
-    response = StreamingResponse(BytesIO(tts_res.content), media_type="audio/wav")
-    response.headers["X-GPT-Reply"] = encoded_reply
-    response.headers["Access-Control-Expose-Headers"] = "X-GPT-Reply"
-
     end_time = time.time()
-    print(f"[⏱️] 전체 처리 시간: {end_time - start_time:.2f}s")
+    metrics.observe("total", end_time - start_time)
+    log.info(f"[⏱️] 전체 처리 시간: {end_time - start_time:.2f}s")
 
-    return response
+    # 스트림은 중복 요청이 함께 받을 수 있도록 공유 (요청이 하나면 그대로 흘려보냄)
+    if not isinstance(audio, bytes):
+        audio = SharedStream(audio)
+    return reply, audio
+
+
+# =========================
+# メインエンドポイント
+# =========================
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """백엔드 과부하 → 503 + Retry-After (클라이언트가 잠시 후 재시도)"""
+    metrics.incr("http_503")
+    log.warning("[🚦] 과부하로 거절: %s (Retry-After %ss)", exc.backend, exc.retry_after,
+                extra={"kind": "shed"})
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "混み合っています。少し待ってから再試行してください。", "backend": exc.backend},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+def _over_limit(user_id):
+    return defense.is_repeat_offender(user_id) or not rate_limiter.is_allowed(user_id)
+
+async def check_rate_limit(user_id):
+    """반복 공격자 / 요청 한도 초과 시 429"""
+    if await shared_state.run(_over_limit, user_id):
+        metrics.incr("http_429")
+        raise HTTPException(
+            status_code=429, 
+            detail="要求が多すぎます。少し待ってから再試行してください。"
+        )
+
+async def injection_reply(user_id, user_input):
+    """인젝션 시도면 (안전한 응답, 음성) 또는 에러 dict, 아니면 None"""
+    rule = defense.match_rule(user_input)
+    if rule is None:
+        return None
+    await shared_state.run(defense.log_attempt, user_id, user_input, rule)
+    log.warning(f"[⚠️] 인젝션 시도 감지: {user_id} ({rule}) - {user_input}")
+    metrics.incr("injection_blocked")
+    
+    safe_response = defense.get_safe_response()
+    
+    # 미리 생성한 음성 사용 (없으면 TTS 생성, 중립)
+    audio = safe_response_audio.get(safe_response)
+    if audio is None:
+        audio = await synthesize(safe_response, NEUTRAL_EMOTION)
+        if audio is None:
+            return {"error": "TTS 생성 실패"}
+    return safe_response, audio
+
+@app.post("/chat-agent")
+async def chat_agent(req: ChatRequest, request: Request):
+    user_id = req.user_id
+    user_input = req.message
+    # 이 요청에서 파생된 태스크의 로그에도 같은 id가 붙음
+    request_id_var.set(uuid.uuid4().hex[:12])
+    
+    # Rate limiting 체크 (반복 공격자는 인젝션 검사/TTS 전에 차단)
+    await check_rate_limit(user_id)
+    
+    # 프롬프트 인젝션 검사 → 안전한 응답 즉시 반환
+    blocked = await injection_reply(user_id, user_input)
+    if blocked is not None:
+        if not isinstance(blocked, tuple):
+            return blocked
+        safe_response, audio = blocked
+        return audio_response(audio, safe_response)
+
+    # 같은 사용자의 요청은 순서대로, 같은 메시지의 중복 제출은 결과 공유
+    result = await inflight.run(user_id, user_input, lambda: chat_pipeline(user_id, user_input), request)
+    if not isinstance(result, tuple):
+        return result
+    reply, audio = result
+    if isinstance(audio, SharedStream):
+        audio = audio.subscribe()
+    return audio_response(audio, reply)
+
+# =========================
+# WebSocket 대화 (사용자당 연결 1개)
+# =========================
+WS_AUDIO_FRAME = 32 * 1024  # 바이너리 프레임 최대 크기
+
+# user_id → 현재 연결 (새 연결이 들어오면 이전 연결을 닫음)
+ws_connections = {}
+
+async def _ws_send_events(websocket, events):
+    """큐의 진행 이벤트를 순서대로 전송 (None이면 종료) → 보낸 이벤트 종류"""
+    sent = set()
+    while True:
+        event = await events.get()
+        if event is None:
+            return sent
+        await websocket.send_json(event)
+        sent.add(event["type"])
+
+async def ws_turn(websocket, user_id, user_input):
+    """한 턴: status/token/reply/emotion 이벤트 → 음성 바이너리 프레임 → done"""
+    request_id_var.set(uuid.uuid4().hex[:12])
+    start_time = time.time()
+    try:
+        await check_rate_limit(user_id)
+    except HTTPException as e:
+        await websocket.send_json({"type": "error", "status": e.status_code, "detail": e.detail})
+        return
+    await websocket.send_json({"type": "status", "stage": "received"})
+
+    blocked = await injection_reply(user_id, user_input)
+    if blocked is not None:
+        result, sent = blocked, set()
+        if isinstance(blocked, tuple):
+            await websocket.send_json({"type": "reply", "text": blocked[0]})
+            await websocket.send_json({"type": "emotion", "vector": NEUTRAL_EMOTION, "label": "중립"})
+            sent = {"reply", "emotion"}
+    else:
+        # 파이프라인 단계가 emit()한 이벤트를 그대로 중계
+        events = asyncio.Queue()
+        event_sink_var.set(events.put_nowait)
+        sender = asyncio.create_task(_ws_send_events(websocket, events))
+        try:
+            result = await inflight.run(user_id, user_input, lambda: chat_pipeline(user_id, user_input))
+            # 공유 스트림은 결과를 받은 즉시 구독 (이벤트 전송을 기다리는 동안 앞부분이 버려지지 않게)
+            if isinstance(result, tuple) and isinstance(result[1], SharedStream):
+                result = result[0], result[1].subscribe()
+        except HTTPException as e:
+            result = {"error": e.detail, "status": e.status_code}
+        finally:
+            event_sink_var.set(None)
+            events.put_nowait(None)
+        sent = await sender
+
+    if not isinstance(result, tuple):
+        await websocket.send_json({"type": "error", "status": result.get("status", 500),
+                                   "detail": result["error"]})
+        return
+    reply, audio = result
+    # 다른 요청이 시작한 결과를 공유받은 경우 자막은 여기서
+    if "reply" not in sent:
+        await websocket.send_json({"type": "reply", "text": reply})
+
+    if isinstance(audio, bytes):
+        audio = _iter_cached(audio)
+    await websocket.send_json({"type": "audio", "media_type": "audio/wav"})
+    async for chunk in audio:
+        for i in range(0, len(chunk), WS_AUDIO_FRAME):
+            await websocket.send_bytes(chunk[i:i + WS_AUDIO_FRAME])
+    elapsed = time.time() - start_time
+    metrics.observe("ws_turn", elapsed)
+    await websocket.send_json({"type": "done", "elapsed_ms": round(elapsed * 1000, 1)})
+
+@app.websocket("/ws/chat-agent")
+async def chat_agent_ws(websocket: WebSocket, user_id: str):
+    await websocket.accept()
+    previous = ws_connections.get(user_id)
+    ws_connections[user_id] = websocket
+    if previous is not None:
+        log.info(f"[🔌] 이전 WebSocket 연결 대체: {user_id}")
+        metrics.incr("ws:replaced")
+        try:
+            await previous.close(code=4000, reason="replaced")
+        except RuntimeError:
+            pass  # 이미 닫힘
+    metrics.incr("ws:connected")
+    log.info(f"[🔌] WebSocket 연결: {user_id}")
+
+    try:
+        while True:
+            try:
+                data = json.loads(await websocket.receive_text())
+            except ValueError:
+                data = None
+            message = data.get("message") if isinstance(data, dict) else None
+            if not isinstance(message, str) or not message:
+                await websocket.send_json({"type": "error", "status": 422,
+                                           "detail": '{"message": "..."} 形式で送ってください'})
+                continue
+            try:
+                await ws_turn(websocket, user_id, message)
+            except Overloaded as e:
+                metrics.incr("http_503")
+                await websocket.send_json({"type": "error", "status": 503, "retry_after": e.retry_after,
+                                           "detail": "混み合っています。少し待ってから再試行してください。"})
+            except httpx.HTTPError as e:
+                # 음성 스트림 도중 TTS 오류 - 연결은 유지
+                log.error(f"[❌] WebSocket 음성 전송 오류: {str(e)}")
+                await websocket.send_json({"type": "error", "detail": "TTS 생성 실패"})
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                # 소켓이 닫혀서 난 오류는 바깥에서 처리, 그 밖의 예외는 이번 턴만 실패로
+                if WebSocketState.DISCONNECTED in (websocket.client_state, websocket.application_state):
+                    raise
+                log.error(f"[❌] WebSocket 턴 처리 오류: {type(e).__name__}: {str(e)}")
+                metrics.incr("ws:turn_error")
+                await websocket.send_json({"type": "error", "status": 500, "detail": "内部エラーが発生しました"})
+    except WebSocketDisconnect:
+        pass
+    except RuntimeError:
+        # 새 연결로 대체되어 닫힌 뒤의 송수신
+        if websocket.application_state != WebSocketState.DISCONNECTED:
+            raise
+    finally:
+        if ws_connections.get(user_id) is websocket:
+            del ws_connections[user_id]
+        log.info(f"[🔌] WebSocket 종료: {user_id}")
 
 # =========================
 # 헬스체크 엔드포인트
 # =========================
 @app.get("/health")
 def health_check():
-    return {
-        "status": "healthy",
-        "assistant_id": assistant.id if 'assistant' in globals() else None,
+    ready = ENGINE == "chat" or assistant_provisioner.ready
+    provision_s = assistant_provisioner.elapsed
+    body = {
+        "status": "healthy" if ready else "starting",
+        "ready": ready,
+        "engine": ENGINE,
+        "assistant_id": assistant_provisioner.assistant_id,
+        "assistant_error": assistant_provisioner.error,
+        "assistant_provision_ms": round(provision_s * 1000, 1) if provision_s is not None else None,
         "threads_count": len(thread_manager.threads),
+        "history_users": len(history_store),
+        "ws_connections": len(ws_connections),
+        "state_backend": type(shared_state).__name__,
         "rate_limiter_active": True,
         "injection_defense_active": True
     }
+    # 준비 전에는 로드밸런서가 트래픽을 보내지 않도록 503
+    return body if ready else JSONResponse(body, status_code=503)
+
+# =========================
+# 메트릭 엔드포인트
+# =========================
+@app.get("/metrics")
+def get_metrics():
+    snapshot = metrics.snapshot()
+    snapshot["counters"]["log_dropped"] = _DroppingQueueHandler.dropped
+    # 백엔드별 동시 실행/대기열 (대기 시간은 stages의 queue:<backend>)
+    snapshot["admission"] = {name: gate.snapshot() for name, gate in admission.items()}
+    return snapshot
 
 # =========================
 # 루트 엔드포인트
@@ -684,7 +2983,8 @@ def root():
         "version": "2.0.0",
         "endpoints": {
             "/chat-agent": "채팅 엔드포인트",
-            "/health": "헬스체크"
+            "/health": "헬스체크",
+            "/metrics": "단계별 지연/카운터"
         },
         "security_features": [
             "Rate Limiting (분당 10회)",